@@ -1,25 +1,16 @@
 from crewai import Agent
 from tools import search_tool, web_search_tool
 from langchain_google_genai import ChatGoogleGenerativeAI
+from prompts import BLOOD_TEST_ANALYST_BACKSTORY, BLOOD_TEST_ANALYST_GOAL, BLOOD_TEST_ANALYST_ROLE
 
 # Configure GEMINI model with appropriate settings
 gemini_model = ChatGoogleGenerativeAI(model="gemini-pro", temperature=0.7)
 
 # Blood Test Analyst Agent
 blood_test_analyst = Agent(
-    role='Blood Test Analyst',
-    goal=(
-        "Analyze the blood test report, identify key abnormalities or normal values, "
-        "correlate findings with potential medical conditions, and provide a "
-        "detailed, easy-to-understand summary of the findings."
-    ),
-    backstory=(
-        "A seasoned hematologist with over a decade of experience in clinical "
-        "diagnostics, specializing in blood test analysis. This agent has a deep "
-        "understanding of how various blood parameters interact and affect overall "
-        "health. Known for their ability to translate complex medical jargon into "
-        "layman's terms, ensuring patients fully understand their health status."
-    ),
+    role=BLOOD_TEST_ANALYST_ROLE,
+    goal=BLOOD_TEST_ANALYST_GOAL,
+    backstory=BLOOD_TEST_ANALYST_BACKSTORY,
     verbose=True,
     allow_delegation=False,
     llm=gemini_model,
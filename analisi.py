@@ -0,0 +1,521 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# NUCLEO DELL'ANALISI (SENZA INTERFACCIA)
+# ==================================================
+# Prompt, chiamate a Gemini e preparazione del contenuto del referto.
+# Usato dall'app Streamlit (main.py), dall'esecuzione batch (batch.py)
+# e dall'API HTTP (api.py).
+
+import functools
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import google.generativeai as genai
+from google.api_core import exceptions
+
+from analiti import indice_analiti
+from cache_risultati import calcola_chiave
+from compattazione import RisultatoCompattazione, compatta_pagine
+from immagini import ConfigImmagine, preelabora_immagine
+from metriche import (
+    misura, registra_cache, registra_dimensione, registra_tentativo, registra_uso_token,
+)
+from parser_valori import estrai_valori, prepara_input_compatto
+from router_pagine import RASTERIZZAZIONE_DISPONIBILE, PaginaImmagine, RisultatoRouter, instrada_pagine
+from resilienza import (
+    PERMANENTE, QUOTA, CircuitBreaker, Scadenza, calcola_backoff,
+    classifica_errore, ritardo_suggerito,
+)
+
+# ==================================================
+# CONFIGURAZIONE MODELLO (AGGIORNATO GEMINI 2.5)
+# ==================================================
+MODEL_NAME = 'gemini-2.5-flash' # <--- AGGIORNATO QUI
+
+# Impostazioni di sicurezza RILASSATE per termini medici
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"},
+]
+
+# Tentativi, backoff esponenziale con jitter e budget di tempo per richiesta
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+DEADLINE_RICHIESTA = 90.0
+
+# Circuit breaker condiviso da tutte le sessioni/thread del processo
+circuito_gemini = CircuitBreaker(soglia_fallimenti=5, tempo_apertura=30.0)
+
+# Limiti per l'estrazione dei PDF lunghi
+MAX_PAGINE_PDF = 100
+TIMEOUT_PAGINA_PDF = 20
+
+# Compattazione del testo: True invia solo righe di esami e note del laboratorio
+COMPATTA_SOLO_ANALITI = False
+
+# Sotto questo numero di valori riconosciuti si invia il testo integrale
+MIN_VALORI_TABELLA = 3
+
+# Da incrementare ad ogni modifica del prompt: invalida la cache dei risultati
+PROMPT_VERSION = "4"
+
+PROMPT_REFERTO = """
+    Agisci come un assistente esperto nella lettura di dati biomedici. Analizza questo referto medico (analisi del sangue) in italiano.
+    
+    **⚠️ REGOLA FONDAMENTALE:** 
+    NON FARE DIAGNOSI. Il tuo compito è solo estrarre e spiegare i dati.
+
+    Genera un report strutturato ESATTAMENTE in questi 4 punti:
+
+    **📊 1. Valori Fuori Norma:**
+    *   Elenca SOLO i valori che sono esplicitamente segnati come "fuori range" (spesso con asterischi * o grassetto).
+    *   Indica: Nome Esame | Valore Rilevato | Range di Riferimento.
+    *   Se TUTTI i valori sono nella norma, scrivilo chiaramente.
+
+    **⚠️ 2. Spiegazione Semplificata:**
+    *   Per ogni valore fuori norma identificato sopra, spiega brevemente in parole semplici a cosa si riferisce.
+    *   Usa un linguaggio condizionale: "Valori alti potrebbero indicare...", "Generalmente associato a...".
+
+    **🩺 3. Note dal Referto:**
+    *   Riporta eventuali note scritte dal laboratorio.
+
+    **💡 4. Consigli Generici (Stile di Vita):**
+    *   Fornisci 2-3 consigli molto generali sullo stile di vita (idratazione, sonno, dieta).
+    *   NON consigliare farmaci.
+    """
+
+DISCLAIMER_APP = "\n\n---\n**⚠️ DISCLAIMER:** *Analisi automatica IA (Gemini 2.5). Non sostituisce il medico.*"
+AVVISO_DEGRADATO = "⚠️ Servizio Gemini temporaneamente degradato: riprova tra qualche istante."
+AVVISO_INTERROTTA = "\n\n⚠️ *Analisi interrotta: la risposta è incompleta.*"
+PDF_ILLEGGIBILE = "❌ PDF vuoto o illeggibile."
+MESSAGGIO_SCADUTO = "⚠️ Tempo massimo superato prima dell'analisi."
+DISCLAIMER_VELOCE = "\n\n---\n**⚠️ DISCLAIMER:** *Lettura automatica dei valori (senza IA). Non sostituisce il medico.*"
+
+# ==================================================
+# FUNZIONI HELPER
+# ==================================================
+
+def configura_gemini(api_key=None):
+    api_key = api_key or os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Chiave API Gemini non trovata (GEMINI_API_KEY).")
+    genai.configure(api_key=api_key)
+
+def prepara_input(contenuto, tipo_contenuto):
+    prompt = PROMPT_REFERTO
+    if isinstance(contenuto, list):
+        # Contenuto misto (piu' file, pagine scansionate): testo e immagini in ordine
+        return [prompt, *contenuto]
+    if tipo_contenuto == "immagine":
+        return [prompt, contenuto]
+    return f"{prompt}\n\n--- REFERTO ---\n{contenuto}"
+
+@functools.lru_cache(maxsize=None)
+def get_model(nome=MODEL_NAME):
+    # Il client viene creato una volta sola e riusato da tutte le richieste
+    with misura("creazione_modello"):
+        return genai.GenerativeModel(nome)
+
+def _dimensione_input(input_content):
+    if isinstance(input_content, str):
+        return len(input_content.encode("utf-8"))
+    totale = 0
+    for parte in input_content:
+        if isinstance(parte, str):
+            totale += len(parte.encode("utf-8"))
+        elif isinstance(parte, dict):
+            totale += len(parte.get("data", b""))
+    return totale
+
+def _testo_risposta(risposta):
+    # .text solleva ValueError se la risposta non ha parti (es. bloccata)
+    try:
+        return risposta.text
+    except (ValueError, AttributeError):
+        return ""
+
+def _chunk_bloccato(chunk):
+    for candidato in getattr(chunk, 'candidates', None) or []:
+        motivo = getattr(candidato, 'finish_reason', None)
+        if getattr(motivo, 'name', motivo) == "SAFETY":
+            return True
+    return False
+
+def _messaggio_errore(e):
+    if isinstance(e, exceptions.NotFound) or "not found" in str(e).lower() or "404" in str(e):
+        return f"❌ Errore Modello: {MODEL_NAME} non trovato."
+    if isinstance(e, exceptions.GoogleAPIError):
+        return f"❌ Errore API Gemini: {str(e)}"
+    return f"❌ Errore imprevisto: {str(e)}"
+
+def _attesa_dopo_errore(e, tentativo):
+    # Per gli errori di quota si rispetta il ritardo indicato dal server
+    attesa = calcola_backoff(tentativo, BACKOFF_BASE, BACKOFF_MAX)
+    if classifica_errore(e) == QUOTA:
+        attesa = max(attesa, ritardo_suggerito(e) or BACKOFF_MAX)
+    return attesa
+
+def analizza_referto_medico(contenuto, tipo_contenuto, scadenza=None, prima_della_chiamata=None):
+    # prima_della_chiamata viene invocata prima di ogni tentativo (anche i
+    # retry), es. per un limitatore di richieste al minuto
+    input_content = prepara_input(contenuto, tipo_contenuto)
+    scadenza = scadenza or Scadenza(DEADLINE_RICHIESTA)
+    registra_dimensione("input", _dimensione_input(input_content))
+
+    for tentativo in range(MAX_RETRIES):
+        # Prima del circuit breaker: l'attesa non occupa il posto di prova
+        if prima_della_chiamata is not None:
+            prima_della_chiamata()
+        if not circuito_gemini.consenti():
+            return AVVISO_DEGRADATO
+        try:
+            with misura("generate_content"):
+                risposta = get_model().generate_content(
+                    input_content,
+                    safety_settings=SAFETY_SETTINGS,
+                    request_options={"timeout": scadenza.rimanente()},
+                )
+            circuito_gemini.registra_successo()
+            registra_uso_token(risposta)
+
+            testo = _testo_risposta(risposta)
+            if testo:
+                registra_tentativo("ok")
+                registra_dimensione("output", len(testo.encode("utf-8")))
+                return testo.strip() + DISCLAIMER_APP
+            
+            elif hasattr(risposta, 'prompt_feedback') and risposta.prompt_feedback.block_reason:
+                 registra_tentativo("bloccata")
+                 return f"⚠️ Analisi bloccata dai filtri di sicurezza: {risposta.prompt_feedback.block_reason}"
+
+            # Risposta vuota: si ritenta con backoff
+            registra_tentativo("vuota")
+            attesa = calcola_backoff(tentativo, BACKOFF_BASE, BACKOFF_MAX)
+
+        except Exception as e:
+            classe = classifica_errore(e)
+            registra_tentativo(f"errore_{classe}")
+            if classe == PERMANENTE:
+                # Il servizio ha risposto: per il circuito e' un successo
+                circuito_gemini.registra_successo()
+                return _messaggio_errore(e)
+            circuito_gemini.registra_fallimento()
+            attesa = _attesa_dopo_errore(e, tentativo)
+
+        # Inutile attendere se il tentativo successivo sforerebbe il budget
+        if not scadenza.consente(attesa):
+            break
+        with misura("attesa_retry"):
+            time.sleep(attesa)
+
+    return "⚠️ Servizio momentaneamente non disponibile."
+
+def analizza_referto_medico_stream(contenuto, tipo_contenuto, scadenza=None, prima_della_chiamata=None):
+    # Versione in streaming di analizza_referto_medico: restituisce i pezzi
+    # di testo man mano che arrivano. Si ritenta solo se non e' ancora
+    # stato emesso nulla, altrimenti il testo a video verrebbe duplicato.
+    input_content = prepara_input(contenuto, tipo_contenuto)
+    scadenza = scadenza or Scadenza(DEADLINE_RICHIESTA)
+    registra_dimensione("input", _dimensione_input(input_content))
+
+    for tentativo in range(MAX_RETRIES):
+        # Prima del circuit breaker: l'attesa non occupa il posto di prova
+        if prima_della_chiamata is not None:
+            prima_della_chiamata()
+        if not circuito_gemini.consenti():
+            yield AVVISO_DEGRADATO
+            return
+        emesso = 0
+        chunk = None
+        registrato = False
+        try:
+            with misura("generate_content_primo_chunk"):
+                risposta = get_model().generate_content(
+                    input_content,
+                    safety_settings=SAFETY_SETTINGS,
+                    stream=True,
+                    request_options={"timeout": scadenza.rimanente()},
+                )
+
+            for chunk in risposta:
+                feedback = getattr(chunk, 'prompt_feedback', None)
+                if feedback and feedback.block_reason:
+                    circuito_gemini.registra_successo()
+                    registrato = True
+                    registra_tentativo("bloccata")
+                    yield f"⚠️ Analisi bloccata dai filtri di sicurezza: {feedback.block_reason}"
+                    return
+                testo = _testo_risposta(chunk)
+                if testo:
+                    emesso += len(testo.encode("utf-8"))
+                    yield testo
+                if _chunk_bloccato(chunk):
+                    circuito_gemini.registra_successo()
+                    registrato = True
+                    registra_tentativo("interrotta")
+                    yield AVVISO_INTERROTTA + DISCLAIMER_APP
+                    return
+
+            circuito_gemini.registra_successo()
+            registrato = True
+            # usage_metadata completo arriva con l'ultimo chunk
+            if chunk is not None:
+                registra_uso_token(chunk)
+            if emesso:
+                registra_tentativo("ok")
+                registra_dimensione("output", emesso)
+                yield DISCLAIMER_APP
+                return
+            registra_tentativo("vuota")
+            attesa = calcola_backoff(tentativo, BACKOFF_BASE, BACKOFF_MAX)
+
+        except Exception as e:
+            classe = classifica_errore(e)
+            registra_tentativo(f"errore_{classe}")
+            permanente = classe == PERMANENTE
+            if permanente:
+                circuito_gemini.registra_successo()
+            else:
+                circuito_gemini.registra_fallimento()
+            registrato = True
+            if emesso:
+                yield AVVISO_INTERROTTA + DISCLAIMER_APP
+                return
+            if permanente:
+                yield _messaggio_errore(e)
+                return
+            attesa = _attesa_dopo_errore(e, tentativo)
+        finally:
+            # Generatore chiuso a meta' risposta: la prova non deve restare appesa
+            if not registrato:
+                circuito_gemini.rilascia()
+
+        if not scadenza.consente(attesa):
+            break
+        with misura("attesa_retry"):
+            time.sleep(attesa)
+
+    yield "⚠️ Servizio momentaneamente non disponibile."
+
+def risultato_completo(risultato):
+    return risultato.endswith(DISCLAIMER_APP) and AVVISO_INTERROTTA not in risultato
+
+_RE_SEZIONE_FUORI_NORMA = re.compile(r"Valori Fuori Norma:?\**(.*?)(?=^\W*2\.|\Z)", re.S | re.M)
+_RE_ETICHETTA = re.compile(r"^[\s>*•|-]*(?:\d+[.)]\s+)?([^|:\n]+)")
+
+def analiti_fuori_norma(risultato):
+    # Codici canonici degli esami elencati dal modello al punto 1, senza
+    # altre chiamate: servono per confrontare e deduplicare i risultati
+    sezione = _RE_SEZIONE_FUORI_NORMA.search(risultato or "")
+    if sezione is None:
+        return []
+    indice = indice_analiti()
+    codici = []
+    for riga in sezione.group(1).splitlines():
+        m = _RE_ETICHETTA.match(riga.replace("**", ""))
+        codice = indice.codice(m.group(1)) if m else None
+        if codice and codice not in codici:
+            codici.append(codice)
+    return codici
+
+def fuori_norma_non_citati(risultato, valori):
+    # Esami fuori range per il parser locale che il modello non ha elencato
+    citati = set(analiti_fuori_norma(risultato))
+    mancanti = {}
+    for x in valori:
+        if x.fuori_range and x.codice and x.codice not in citati:
+            mancanti.setdefault(x.codice, x.nome)
+    return list(mancanti.values())
+
+@dataclass
+class TestoReferto:
+    testo: Optional[str]
+    avvisi: List[str] = field(default_factory=list)
+    compattazione: Optional[RisultatoCompattazione] = None
+    # Pagine senza livello di testo, rasterizzate
+    pagine_immagine: List[PaginaImmagine] = field(default_factory=list)
+    instradamento: Optional[RisultatoRouter] = None
+
+def _avviso_pagine_escluse(pagine, rasterizza):
+    elenco = ", ".join(str(i + 1) for i in pagine)
+    if not rasterizza:
+        return f"⚠️ Pagine scansionate non lette in questa modalità: {elenco}"
+    if not RASTERIZZAZIONE_DISPONIBILE:
+        return f"⚠️ Pagine scansionate ignorate (installa pypdfium2 per analizzarle): {elenco}"
+    return f"⚠️ Pagine scansionate non analizzate: {elenco}"
+
+def estrai_testo_referto(dati_file, rasterizza=True):
+    # Testo compattato delle pagine digitali e, per le pagine scansionate,
+    # immagini compresse; con gli avvisi da mostrare all'utente
+    with misura("estrazione_pdf"):
+        router = instrada_pagine(
+            dati_file, max_pagine=MAX_PAGINE_PDF, timeout_pagina=TIMEOUT_PAGINA_PDF,
+            rasterizza=rasterizza,
+        )
+    estrazione = router.estrazione
+    avvisi = []
+    if estrazione.pagine_fallite:
+        pagine = ", ".join(str(i + 1) for i, _ in estrazione.pagine_fallite)
+        avvisi.append(f"⚠️ Pagine non leggibili: {pagine}")
+    if estrazione.pagine_totali > MAX_PAGINE_PDF:
+        avvisi.append(f"⚠️ Analizzate solo le prime {MAX_PAGINE_PDF} pagine su {estrazione.pagine_totali}.")
+    if router.pagine_escluse:
+        avvisi.append(_avviso_pagine_escluse(router.pagine_escluse, rasterizza))
+    registra_dimensione("pdf_testo", router.byte_testo)
+    if router.pagine_immagine:
+        registra_dimensione("pdf_immagini", router.byte_immagini)
+    if router.testo is None:
+        return TestoReferto(None, avvisi, pagine_immagine=router.pagine_immagine, instradamento=router)
+
+    with misura("compattazione"):
+        compattazione = compatta_pagine(
+            [estrazione.testi[i] for i in router.pagine_testo], solo_analiti=COMPATTA_SOLO_ANALITI
+        )
+    testo = compattazione.testo if compattazione.testo.strip() else router.testo
+    return TestoReferto(testo, avvisi, compattazione, router.pagine_immagine, router)
+
+def contenuto_da_testo(testo):
+    # Le righe tabellari vengono inviate come tabella compatta
+    with misura("parser_valori"):
+        valori = estrai_valori(testo)
+    if len(valori) >= MIN_VALORI_TABELLA:
+        return prepara_input_compatto(testo, valori)
+    return testo
+
+def contenuto_da_referto(referto):
+    # Solo pagine digitali: testo come sempre. Con pagine scansionate: parti miste
+    if not referto.pagine_immagine:
+        return contenuto_da_testo(referto.testo) if referto.testo is not None else None
+    parti = []
+    if referto.testo is not None:
+        parti.append(f"--- REFERTO ---\n{contenuto_da_testo(referto.testo)}")
+    for pagina in referto.pagine_immagine:
+        parti += [f"--- PAGINA {pagina.indice + 1} (scansionata) ---", pagina.parte_gemini()]
+    return parti
+
+@dataclass
+class ContenutoPreparato:
+    contenuto: object  # None se il PDF e' vuoto o illeggibile
+    avvisi: List[str] = field(default_factory=list)
+    compattazione: Optional[RisultatoCompattazione] = None
+    testo: Optional[str] = None  # testo estratto (solo PDF)
+    instradamento: Optional[RisultatoRouter] = None
+    # Pagine scansionate escluse (pypdfium2 assente, limite, errore): il
+    # risultato dipende dall'ambiente e non va messo in cache
+    parziale: bool = False
+
+def prepara_contenuto(dati_file, tipo_contenuto, config_immagine=None):
+    # Dal file in memoria al contenuto da inviare a Gemini
+    if tipo_contenuto == "immagine":
+        with misura("preelaborazione_immagine"):
+            immagine = preelabora_immagine(dati_file, config_immagine or ConfigImmagine())
+        return ContenutoPreparato(immagine.parte_gemini())
+    referto = estrai_testo_referto(dati_file)
+    return ContenutoPreparato(
+        contenuto_da_referto(referto), referto.avvisi, referto.compattazione,
+        referto.testo, referto.instradamento, referto.instradamento.parziale,
+    )
+
+# Firme (magic bytes) dei formati accettati: il tipo non dipende dall'estensione
+FIRME_FILE = (
+    (b"%PDF-", "testo"),
+    (b"\xff\xd8\xff", "immagine"),
+    (b"\x89PNG\r\n\x1a\n", "immagine"),
+)
+
+def rileva_tipo(dati_file):
+    for firma, tipo in FIRME_FILE:
+        if dati_file.startswith(firma):
+            return tipo
+    # Alcuni generatori scrivono byte spuri prima dell'intestazione del PDF
+    if b"%PDF-" in dati_file[:1024]:
+        return "testo"
+    return None
+
+def unisci_contenuti(preparati):
+    # Piu' file dello stesso referto (pagine fotografate, PDF della stessa
+    # visita) in un'unica richiesta: (nome, tipo, contenuto) nell'ordine di caricamento
+    parti = [f"Il referto è composto da {len(preparati)} file, nell'ordine seguente."]
+    for nome, tipo, contenuto in preparati:
+        if tipo == "immagine":
+            parti += [f"--- FILE: {nome} (immagine) ---", contenuto]
+        elif isinstance(contenuto, list):
+            parti += [f"--- FILE: {nome} ---", *contenuto]
+        else:
+            parti.append(f"--- FILE: {nome} ---\n{contenuto}")
+    return parti
+
+@dataclass
+class EsitoAnalisi:
+    risultato: str
+    completo: bool
+    da_cache: bool = False
+    avvisi: List[str] = field(default_factory=list)
+    compattazione: Optional[RisultatoCompattazione] = None
+    instradamento: Optional[RisultatoRouter] = None
+    fuori_norma: List[str] = field(default_factory=list)  # codici canonici
+    scaduto: bool = False
+
+def analizza_contenuto(dati_file, tipo_contenuto, produci_contenuto, cache=None, scadenza=None,
+                       su_parte=None, prima_della_chiamata=None):
+    # Pipeline comune a Streamlit, API e batch: cache, preparazione del
+    # contenuto e chiamata a Gemini. dati_file serve solo per la chiave.
+    # - produci_contenuto (-> ContenutoPreparato) viene chiamata solo in caso
+    #   di miss: su un hit non si estrae il PDF e non si contatta Gemini
+    # - su_parte, se presente, riceve il testo in streaming man mano che arriva
+    # - prima_della_chiamata viene invocata prima di ogni tentativo verso il
+    #   modello, retry compresi (es. per un limitatore di richieste al minuto)
+    chiave = calcola_chiave(dati_file, tipo_contenuto, MODEL_NAME, PROMPT_VERSION)
+    if cache is not None:
+        risultato = cache.get(chiave)
+        if risultato is not None:
+            registra_cache("hit")
+            return EsitoAnalisi(risultato, completo=True, da_cache=True,
+                                fuori_norma=analiti_fuori_norma(risultato))
+        registra_cache("miss")
+
+    preparato = produci_contenuto()
+    if preparato.contenuto is None:
+        return EsitoAnalisi(PDF_ILLEGGIBILE, completo=False, avvisi=preparato.avvisi,
+                            instradamento=preparato.instradamento)
+    # L'estrazione puo' aver consumato tutto il budget: niente chiamata
+    if scadenza is not None and scadenza.rimanente() <= 0:
+        return EsitoAnalisi(MESSAGGIO_SCADUTO, completo=False, avvisi=preparato.avvisi,
+                            instradamento=preparato.instradamento, scaduto=True)
+
+    if su_parte is None:
+        risultato = analizza_referto_medico(preparato.contenuto, tipo_contenuto, scadenza,
+                                            prima_della_chiamata)
+    else:
+        parti = []
+        with misura("generazione_streaming"):
+            for parte in analizza_referto_medico_stream(preparato.contenuto, tipo_contenuto, scadenza,
+                                                        prima_della_chiamata):
+                parti.append(parte)
+                su_parte(parte)
+        risultato = "".join(parti).strip()
+
+    # Si salvano solo le analisi riuscite e su tutte le pagine, non i
+    # messaggi di errore
+    completo = risultato_completo(risultato)
+    if completo and cache is not None and not preparato.parziale:
+        cache.set(chiave, risultato)
+    return EsitoAnalisi(risultato, completo=completo, avvisi=preparato.avvisi,
+                        compattazione=preparato.compattazione, instradamento=preparato.instradamento,
+                        fuori_norma=analiti_fuori_norma(risultato) if completo else [])
+
+def analizza_dati(dati_file, tipo_contenuto, cache=None, config_immagine=None, scadenza=None,
+                  su_parte=None, prima_della_chiamata=None):
+    # Pipeline completa per un file gia' letto in memoria
+    return analizza_contenuto(
+        dati_file, tipo_contenuto,
+        lambda: prepara_contenuto(dati_file, tipo_contenuto, config_immagine),
+        cache, scadenza, su_parte, prima_della_chiamata,
+    )
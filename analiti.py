@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# INDICE DEI SINONIMI DEGLI ANALITI
+# ==================================================
+# I referti chiamano lo stesso esame in molti modi ("Emoglobina", "HGB",
+# "Hb", "Colesterolo LDL", "LDL-C"). L'indice, costruito una volta per
+# processo da analiti.json, porta ogni etichetta al codice canonico con
+# unita' e range di riferimento predefiniti:
+#   1. corrispondenza esatta (dizionario sull'etichetta normalizzata)
+#   2. prefisso piu' lungo a confine di parola, solo se il resto
+#      dell'etichetta e' un qualificatore innocuo ("Glucosio (siero)")
+#   3. distanza di edit limitata sul trie ("Emoglobnia", errori di OCR)
+# Con l'unita' di misura si sceglie la variante giusta dello stesso esame
+# ("Neutrofili" in % -> NEUT%, in 10^3/uL -> NEUT).
+
+import functools
+import json
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+ANALITI_PATH = os.getenv(
+    "REFERTI_ANALITI_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "analiti.json")
+)
+
+# Distanza di edit ammessa in base alla lunghezza dell'etichetta: le sigle
+# corte ("K", "Na", "AST") valgono solo se esatte
+MIN_LUNGHEZZA_FUZZY = 5
+LUNGHEZZA_DISTANZA_2 = 10
+MAX_MEMO = 4096
+
+# Parole che possono seguire un nome noto senza cambiarne il significato.
+# Tutto il resto ("urine", "ionizzato", "libero", "clearance") puo' indicare
+# un altro esame o un altro campione e blocca la corrispondenza per prefisso
+QUALIFICATORI_INNOCUI = frozenset("""
+    a di del della in su con e
+    siero sierico sierica plasma plasmatico plasmatica sangue ematico ematica s p
+    digiuno basale totale totali calcolato calcolata calcolati dosaggio determinazione
+    metodo enzimatico enzimatica colorimetrico hplc eclia cmia clia quantitativo quantitativa
+""".split())
+
+ESATTO = "esatto"
+PREFISSO = "prefisso"
+FUZZY = "fuzzy"
+
+_FINE = ""  # chiave del nodo terminale nel trie (mai un carattere valido)
+_RE_SEPARATORI = re.compile(r"[^\w%#]+")
+_RE_UNITA = re.compile(r"\s+")
+_RE_SIGLA_PUNTATA = re.compile(r"\b[a-z](?: [a-z]\b)+")
+
+
+@dataclass(frozen=True)
+class Analita:
+    codice: str
+    nome: str
+    unita: str
+    rif_min: Optional[float]
+    rif_max: Optional[float]
+    sinonimi: Tuple[str, ...] = ()
+
+    def rif_testo(self):
+        if self.rif_min is not None and self.rif_max is not None:
+            return f"{self.rif_min:g} - {self.rif_max:g}"
+        if self.rif_max is not None:
+            return f"< {self.rif_max:g}"
+        if self.rif_min is not None:
+            return f"> {self.rif_min:g}"
+        return ""
+
+
+@dataclass(frozen=True)
+class Corrispondenza:
+    analita: Analita
+    metodo: str
+    distanza: int = 0
+
+
+def normalizza_etichetta(testo):
+    # "Colesterolo L.D.L." -> "colesterolo ldl"; "Velocità" -> "velocita"
+    testo = unicodedata.normalize("NFKD", testo)
+    testo = "".join(c for c in testo if not unicodedata.combining(c)).casefold()
+    testo = " ".join(_RE_SEPARATORI.sub(" ", testo).replace("_", " ").split())
+    # Le sigle puntate diventano una parola sola: "l d l" -> "ldl"
+    return _RE_SIGLA_PUNTATA.sub(lambda m: m.group().replace(" ", ""), testo)
+
+
+def normalizza_unita(unita):
+    # "µg/dL" e "ug/dl" sono la stessa unita'; "x10^3/µL" e "10^3/uL" anche
+    unita = _RE_UNITA.sub("", unita or "").replace("µ", "u").replace("μ", "u").casefold()
+    unita = unita.replace("mcg", "ug").replace("mmc", "ul").replace("mm3", "ul")
+    return unita[1:] if unita.startswith("x10^") else unita
+
+
+def _radice(chiave):
+    # "neutrofili %" e "neutrofili #" appartengono alla famiglia "neutrofili"
+    return chiave.removesuffix(" %").removesuffix(" #")
+
+
+def _innocuo(resto):
+    return all(parola in QUALIFICATORI_INNOCUI for parola in resto.split())
+
+
+def _massima_distanza(chiave):
+    if len(chiave) < MIN_LUNGHEZZA_FUZZY:
+        return 0
+    return 2 if len(chiave) >= LUNGHEZZA_DISTANZA_2 else 1
+
+
+class IndiceAnaliti:
+    def __init__(self, analiti):
+        self.analiti = {}
+        self._esatti = {}
+        self._trie = {}
+        self._memo = {}
+        famiglie = {}
+        for analita in analiti:
+            self.analiti[analita.codice] = analita
+            for etichetta in (analita.codice, analita.nome, *analita.sinonimi):
+                self._aggiungi(normalizza_etichetta(etichetta), analita.codice)
+            famiglie.setdefault(_radice(normalizza_etichetta(analita.nome)), []).append(analita.codice)
+        # Varianti dello stesso esame che differiscono per unita' (conta e %)
+        self._varianti = {c: codici for codici in famiglie.values() for c in codici}
+
+    def _aggiungi(self, chiave, codice):
+        precedente = self._esatti.setdefault(chiave, codice)
+        if precedente != codice:
+            raise ValueError(f"Sinonimo '{chiave}' assegnato sia a {precedente} sia a {codice}")
+        nodo = self._trie
+        for carattere in chiave:
+            nodo = nodo.setdefault(carattere, {})
+        nodo[_FINE] = codice
+
+    def __len__(self):
+        return len(self.analiti)
+
+    def cerca(self, etichetta, fuzzy=True, unita=None) -> Optional[Corrispondenza]:
+        # Le etichette si ripetono da un referto all'altro: memo sul testo grezzo
+        memo = (etichetta, fuzzy, unita)
+        if memo in self._memo:
+            return self._memo[memo]
+        trovato = self._cerca(normalizza_etichetta(etichetta), fuzzy)
+        if trovato is not None and unita is not None:
+            trovato = self._per_unita(trovato, unita)
+        if len(self._memo) >= MAX_MEMO:
+            self._memo.clear()
+        self._memo[memo] = trovato
+        return trovato
+
+    def _cerca(self, chiave, fuzzy):
+        if not chiave:
+            return None
+        codice = self._esatti.get(chiave)
+        if codice is not None:
+            return Corrispondenza(self.analiti[codice], ESATTO)
+        codice = self._prefisso(chiave)
+        if codice is not None:
+            return Corrispondenza(self.analiti[codice], PREFISSO)
+        massimo = _massima_distanza(chiave) if fuzzy else 0
+        if massimo:
+            trovato = self._fuzzy(chiave, massimo)
+            if trovato is not None:
+                distanza, codice = trovato
+                return Corrispondenza(self.analiti[codice], FUZZY, distanza)
+        return None
+
+    def _per_unita(self, trovato, unita):
+        unita = normalizza_unita(unita)
+        if normalizza_unita(trovato.analita.unita) == unita:
+            return trovato
+        for codice in self._varianti[trovato.analita.codice]:
+            if normalizza_unita(self.analiti[codice].unita) == unita:
+                return Corrispondenza(self.analiti[codice], trovato.metodo, trovato.distanza)
+        # Stesso esame in un'altra unita' (glucosio in mmol/L): il codice resta
+        return trovato
+
+    def codice(self, etichetta, fuzzy=True, unita=None):
+        trovato = self.cerca(etichetta, fuzzy, unita)
+        return trovato.analita.codice if trovato is not None else None
+
+    def _prefisso(self, chiave):
+        # Etichetta nota piu' lunga che termina a confine di parola e seguita
+        # solo da qualificatori innocui
+        nodo, trovato = self._trie, None
+        for i, carattere in enumerate(chiave):
+            if carattere == " " and _FINE in nodo and _innocuo(chiave[i + 1:]):
+                trovato = nodo[_FINE]
+            nodo = nodo.get(carattere)
+            if nodo is None:
+                break
+        return trovato
+
+    def _fuzzy(self, chiave, massimo):
+        # Levenshtein riga per riga lungo il trie: i rami la cui riga supera
+        # gia' il massimo vengono potati senza visitarne le foglie
+        migliori = {}
+        pila = [(self._trie, list(range(len(chiave) + 1)))]
+        while pila:
+            nodo, riga = pila.pop()
+            for carattere, figlio in nodo.items():
+                if carattere == _FINE:
+                    continue
+                nuova = [riga[0] + 1]
+                for j in range(1, len(chiave) + 1):
+                    nuova.append(min(nuova[j - 1] + 1, riga[j] + 1,
+                                     riga[j - 1] + (chiave[j - 1] != carattere)))
+                if _FINE in figlio and nuova[-1] <= massimo:
+                    codice = figlio[_FINE]
+                    migliori[codice] = min(nuova[-1], migliori.get(codice, massimo))
+                if min(nuova) <= massimo:
+                    pila.append((figlio, nuova))
+        if not migliori:
+            return None
+        distanza = min(migliori.values())
+        codici = [c for c, d in migliori.items() if d == distanza]
+        # A parita' di distanza fra analiti diversi non si sceglie a caso
+        return (distanza, codici[0]) if len(codici) == 1 else None
+
+
+def carica_indice(path=ANALITI_PATH):
+    with open(path, encoding="utf-8") as f:
+        voci = json.load(f)
+    return IndiceAnaliti(
+        Analita(v["codice"], v["nome"], v.get("unita", ""), v.get("rif_min"), v.get("rif_max"),
+                tuple(v.get("sinonimi", ())))
+        for v in voci
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def indice_analiti(path=ANALITI_PATH):
+    return carica_indice(path)
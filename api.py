@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# API HTTP (SENZA INTERFACCIA)
+# ==================================================
+# Espone la stessa pipeline dell'app Streamlit a integrazioni esterne
+# (es. il servizio di accettazione del laboratorio).
+# Le richieste finiscono in una coda asyncio limitata servita da un
+# numero fisso di worker: a coda piena si risponde 429 invece di
+# accumulare lavoro. Ogni lavoro ha una scadenza che vale sia in coda
+# sia durante le chiamate a Gemini.
+#
+# Avvio:
+#   uvicorn api:app --host 0.0.0.0 --port 8000
+#
+# Endpoint:
+#   POST /analisi                 file multipart -> 202 con l'id del lavoro
+#   POST /analisi?stream=true     come sopra, ma restituisce il testo in streaming
+#   GET  /lavori/{id}             stato e, a fine lavoro, risultato
+#   GET  /lavori/{id}/stream      testo in streaming (anche a lavoro avviato)
+#   GET  /salute                  stato della coda
+#   GET  /metriche                metriche in formato Prometheus
+
+import asyncio
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, File, HTTPException, Query, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+from analisi import MESSAGGIO_SCADUTO, analizza_dati, configura_gemini, rileva_tipo
+from cache_risultati import CacheRisultati
+from metriche import registro
+from resilienza import Scadenza
+
+# ==================================================
+# CONFIGURAZIONE
+# ==================================================
+NUM_WORKER = int(os.getenv("REFERTI_API_WORKER", "4"))
+DIMENSIONE_CODA = int(os.getenv("REFERTI_API_CODA", "32"))
+SCADENZA_PREDEFINITA = float(os.getenv("REFERTI_API_SCADENZA", "120"))
+SCADENZA_MASSIMA = 600.0
+MAX_BYTE_FILE = int(os.getenv("REFERTI_API_MAX_BYTE", str(20 * 1024 * 1024)))
+# I lavori terminati restano consultabili per questo tempo
+CONSERVAZIONE_LAVORI = 15 * 60
+
+IN_CODA = "in_coda"
+IN_CORSO = "in_corso"
+COMPLETATO = "completato"
+ERRORE = "errore"
+SCADUTO = "scaduto"
+TERMINALI = {COMPLETATO, ERRORE, SCADUTO}
+
+
+# ==================================================
+# LAVORI
+# ==================================================
+@dataclass
+class Lavoro:
+    id: str
+    tipo: str
+    dati: Optional[bytes]
+    scadenza: Scadenza
+    stato: str = IN_CODA
+    creato: float = field(default_factory=time.monotonic)
+    iniziato: Optional[float] = None
+    finito: Optional[float] = None
+    parti: List[str] = field(default_factory=list)
+    avvisi: List[str] = field(default_factory=list)
+    completo: bool = False
+    da_cache: bool = False
+    fuori_norma: List[str] = field(default_factory=list)  # codici canonici
+    _evento: asyncio.Event = field(default_factory=asyncio.Event)
+
+    # Tutti i metodi seguenti vanno chiamati dal thread dell'event loop
+
+    def _notifica(self):
+        evento, self._evento = self._evento, asyncio.Event()
+        evento.set()
+
+    def aggiungi(self, parte):
+        self.parti.append(parte)
+        self._notifica()
+
+    def termina(self, stato, risultato=None, completo=False, da_cache=False, avvisi=None, fuori_norma=None):
+        if risultato is not None:
+            self.parti = [risultato]
+        self.completo = completo
+        self.da_cache = da_cache
+        if fuori_norma is not None:
+            self.fuori_norma = fuori_norma
+        if avvisi is not None:
+            self.avvisi = avvisi
+        self.stato = stato
+        self.finito = time.monotonic()
+        self.dati = None  # il file non serve piu'
+        self._notifica()
+
+    async def testo_in_arrivo(self):
+        inviate = 0
+        while True:
+            evento = self._evento
+            if inviate < len(self.parti):
+                parti = self.parti[inviate:]
+                inviate = len(self.parti)
+                yield "".join(parti)
+            elif self.stato in TERMINALI:
+                return
+            else:
+                await evento.wait()
+
+    def descrizione(self):
+        adesso = time.monotonic()
+        voce = {
+            "id": self.id,
+            "tipo": self.tipo,
+            "stato": self.stato,
+            "secondi_in_coda": round((self.iniziato or self.finito or adesso) - self.creato, 3),
+            "scadenza_tra": round(self.scadenza.rimanente(), 3),
+        }
+        if self.iniziato is not None:
+            voce["secondi_elaborazione"] = round((self.finito or adesso) - self.iniziato, 3)
+        if self.stato in TERMINALI:
+            voce.update(
+                risultato="".join(self.parti).strip(),
+                completo=self.completo,
+                da_cache=self.da_cache,
+                fuori_norma=self.fuori_norma,
+                avvisi=self.avvisi,
+            )
+        return voce
+
+
+class CodaPiena(Exception):
+    pass
+
+
+class ServizioAnalisi:
+    def __init__(self, num_worker=NUM_WORKER, dimensione_coda=DIMENSIONE_CODA, cache=None):
+        self.num_worker = num_worker
+        self.coda = asyncio.Queue(maxsize=dimensione_coda)
+        self.cache = cache
+        self.lavori = {}
+        # Le chiamate bloccanti (estrazione, Gemini) girano su thread dedicati
+        self._executor = ThreadPoolExecutor(max_workers=num_worker, thread_name_prefix="analisi")
+        self._worker = []
+        self._loop = None
+
+    async def avvia(self):
+        self._loop = asyncio.get_running_loop()
+        self._worker = [asyncio.create_task(self._ciclo_worker()) for _ in range(self.num_worker)]
+
+    async def ferma(self):
+        for worker in self._worker:
+            worker.cancel()
+        await asyncio.gather(*self._worker, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def invia(self, dati, tipo, scadenza):
+        self._pulisci()
+        lavoro = Lavoro(uuid.uuid4().hex, tipo, dati, Scadenza(scadenza))
+        try:
+            self.coda.put_nowait(lavoro)
+        except asyncio.QueueFull:
+            raise CodaPiena()
+        self.lavori[lavoro.id] = lavoro
+        return lavoro
+
+    def _pulisci(self):
+        limite = time.monotonic() - CONSERVAZIONE_LAVORI
+        for id_lavoro in [i for i, l in self.lavori.items() if l.finito and l.finito < limite]:
+            del self.lavori[id_lavoro]
+
+    async def _ciclo_worker(self):
+        while True:
+            lavoro = await self.coda.get()
+            try:
+                await self._esegui(lavoro)
+            except Exception as e:
+                lavoro.termina(ERRORE, f"❌ {type(e).__name__}: {e}")
+            finally:
+                self.coda.task_done()
+
+    async def _esegui(self, lavoro):
+        # Un lavoro rimasto in coda oltre la scadenza non consuma quota
+        if lavoro.scadenza.rimanente() <= 0:
+            lavoro.termina(SCADUTO, MESSAGGIO_SCADUTO)
+            return
+        lavoro.stato = IN_CORSO
+        lavoro.iniziato = time.monotonic()
+        await self._loop.run_in_executor(self._executor, self._analizza, lavoro)
+
+    def _dal_thread(self, funzione, *argomenti):
+        self._loop.call_soon_threadsafe(funzione, *argomenti)
+
+    def _analizza(self, lavoro):
+        # Gira in un thread dell'executor: lo stato del lavoro viene
+        # aggiornato solo tramite l'event loop
+        inviate = []
+
+        def su_parte(parte):
+            inviate.append(parte)
+            self._dal_thread(lavoro.aggiungi, parte)
+
+        esito = analizza_dati(lavoro.dati, lavoro.tipo, cache=self.cache,
+                              scadenza=lavoro.scadenza, su_parte=su_parte)
+        if esito.scaduto:
+            stato = SCADUTO
+        else:
+            stato = COMPLETATO if esito.completo else ERRORE
+        # Il testo gia' inviato in streaming resta quello del lavoro
+        risultato = None if inviate else esito.risultato
+        self._dal_thread(lavoro.termina, stato, risultato, esito.completo, esito.da_cache,
+                         esito.avvisi, esito.fuori_norma)
+
+    def stato_coda(self):
+        in_corso = sum(1 for l in self.lavori.values() if l.stato == IN_CORSO)
+        return {
+            "worker": self.num_worker,
+            "in_coda": self.coda.qsize(),
+            "capacita_coda": self.coda.maxsize,
+            "in_corso": in_corso,
+            "lavori_conservati": len(self.lavori),
+        }
+
+
+# ==================================================
+# APP
+# ==================================================
+servizio = None
+
+
+@asynccontextmanager
+async def ciclo_di_vita(app):
+    global servizio
+    load_dotenv()
+    configura_gemini()
+    servizio = ServizioAnalisi(cache=CacheRisultati())
+    await servizio.avvia()
+    try:
+        yield
+    finally:
+        await servizio.ferma()
+        registro.scrivi_su_file()
+
+
+app = FastAPI(title="Analisi referti del sangue", lifespan=ciclo_di_vita)
+
+
+def tipo_richiesto(dati, tipo):
+    # Il tipo si deduce dal contenuto (magic bytes), non da nome o Content-Type
+    if tipo and tipo not in ("testo", "immagine"):
+        raise HTTPException(422, "tipo deve essere 'testo' (PDF) o 'immagine'")
+    tipo = tipo or rileva_tipo(dati)
+    if tipo is None:
+        raise HTTPException(415, "Formato non supportato: inviare un PDF, JPG o PNG.")
+    return tipo
+
+
+def _risposta_streaming(lavoro):
+    return StreamingResponse(
+        lavoro.testo_in_arrivo(),
+        media_type="text/plain; charset=utf-8",
+        headers={"X-Lavoro-Id": lavoro.id, "Cache-Control": "no-cache"},
+    )
+
+
+def _trova_lavoro(id_lavoro):
+    lavoro = servizio.lavori.get(id_lavoro)
+    if lavoro is None:
+        raise HTTPException(404, "Lavoro non trovato o scaduto.")
+    return lavoro
+
+
+@app.post("/analisi", status_code=202)
+async def crea_analisi(
+    file: UploadFile = File(...),
+    tipo: Optional[str] = Query(None, description="'testo' (PDF) o 'immagine'; dedotto dal file se assente"),
+    scadenza: float = Query(SCADENZA_PREDEFINITA, gt=0, le=SCADENZA_MASSIMA, description="secondi"),
+    stream: bool = False,
+):
+    dati = await file.read(MAX_BYTE_FILE + 1)
+    if len(dati) > MAX_BYTE_FILE:
+        raise HTTPException(413, f"File troppo grande (massimo {MAX_BYTE_FILE} byte).")
+    if not dati:
+        raise HTTPException(422, "File vuoto.")
+    tipo = tipo_richiesto(dati, tipo)
+    try:
+        lavoro = servizio.invia(dati, tipo, scadenza)
+    except CodaPiena:
+        # Backpressure: il client ritenta piu' tardi invece di accodarsi all'infinito
+        raise HTTPException(429, "Coda piena, riprovare piu' tardi.", headers={"Retry-After": "5"})
+
+    if stream:
+        return _risposta_streaming(lavoro)
+    return {"id": lavoro.id, "stato": lavoro.stato, "stato_url": f"/lavori/{lavoro.id}"}
+
+
+@app.get("/lavori/{id_lavoro}")
+async def stato_lavoro(id_lavoro: str):
+    return _trova_lavoro(id_lavoro).descrizione()
+
+
+@app.get("/lavori/{id_lavoro}/stream")
+async def stream_lavoro(id_lavoro: str):
+    return _risposta_streaming(_trova_lavoro(id_lavoro))
+
+
+@app.get("/salute")
+async def salute():
+    return servizio.stato_coda()
+
+
+@app.get("/metriche", response_class=PlainTextResponse)
+async def metriche():
+    return registro.esporta_prometheus()
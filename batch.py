@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# ANALISI BATCH (SENZA INTERFACCIA)
+# ==================================================
+# Analizza una cartella di referti (o un manifest JSONL) con concorrenza
+# limitata e un limite di richieste al minuto verso Gemini. I risultati
+# vengono scritti su JSONL man mano che ogni file termina; il file di
+# output fa anche da checkpoint per riprendere un'esecuzione interrotta.
+#
+# Esempi:
+#   python batch.py archivio/ -o risultati.jsonl --concorrenza 8 --rpm 60
+#   python batch.py manifest.jsonl -o risultati.jsonl
+#
+# Ogni riga del manifest e' un oggetto JSON con "path" (o "file") e,
+# opzionalmente, "id".
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+from analisi import analizza_dati, configura_gemini, rileva_tipo
+from cache_risultati import CacheRisultati
+from metriche import registro
+
+# Byte letti per riconoscere il formato di un file in una cartella
+BYTE_INTESTAZIONE = 1024
+
+
+class LimitatoreRichieste:
+    # Distribuisce le chiamate in modo uniforme: al massimo `rpm` al minuto,
+    # senza raffiche all'inizio di ogni minuto.
+    def __init__(self, rpm):
+        self.intervallo = 60.0 / rpm if rpm and rpm > 0 else 0.0
+        self._prossimo = 0.0
+        self._lock = threading.Lock()
+
+    def attendi(self):
+        if not self.intervallo:
+            return
+        with self._lock:
+            adesso = time.monotonic()
+            turno = max(adesso, self._prossimo)
+            self._prossimo = turno + self.intervallo
+        attesa = turno - adesso
+        if attesa > 0:
+            time.sleep(attesa)
+
+
+def _formato_supportato(path):
+    # Come app e API: il tipo dipende dal contenuto, non dall'estensione
+    with open(path, "rb") as file:
+        return rileva_tipo(file.read(BYTE_INTESTAZIONE)) is not None
+
+
+def elenca_lavori(sorgente):
+    if os.path.isdir(sorgente):
+        for nome in sorted(os.listdir(sorgente)):
+            path = os.path.join(sorgente, nome)
+            if not nome.startswith(".") and os.path.isfile(path) and _formato_supportato(path):
+                yield nome, path
+        return
+
+    base = os.path.dirname(os.path.abspath(sorgente))
+    with open(sorgente, encoding="utf-8") as file:
+        for numero, riga in enumerate(file, 1):
+            riga = riga.strip()
+            if not riga:
+                continue
+            voce = json.loads(riga)
+            path = voce.get("path") or voce.get("file")
+            if not path:
+                raise ValueError(f"{sorgente}:{numero}: manca il campo 'path'")
+            if not os.path.isabs(path):
+                path = os.path.join(base, path)
+            yield str(voce.get("id") or path), path
+
+
+def leggi_completati(output):
+    # Checkpoint: si saltano solo i file gia' analizzati con successo
+    completati = set()
+    if not os.path.exists(output):
+        return completati
+    with open(output, encoding="utf-8") as file:
+        for riga in file:
+            try:
+                voce = json.loads(riga)
+            except json.JSONDecodeError:
+                # Ultima riga troncata da un'interruzione: verra' rifatta
+                continue
+            if voce.get("stato") == "ok":
+                completati.add(voce.get("id"))
+    return completati
+
+
+def analizza_file(id_lavoro, path, cache, limitatore):
+    inizio = time.monotonic()
+    voce = {"id": id_lavoro, "path": path}
+    try:
+        with open(path, "rb") as file:
+            dati = file.read()
+        tipo = rileva_tipo(dati)
+        if tipo is None:
+            raise ValueError("formato non supportato (attesi PDF, JPG o PNG)")
+        esito = analizza_dati(dati, tipo, cache=cache, prima_della_chiamata=limitatore.attendi)
+        voce.update(
+            stato="ok" if esito.completo else "errore",
+            risultato=esito.risultato,
+            avvisi=esito.avvisi,
+            da_cache=esito.da_cache,
+            fuori_norma=esito.fuori_norma,
+        )
+        if esito.instradamento is not None:
+            voce["pagine"] = esito.instradamento.payload()
+        if esito.compattazione is not None:
+            voce["token_stimati"] = {
+                "prima": esito.compattazione.token_prima,
+                "dopo": esito.compattazione.token_dopo,
+            }
+    except Exception as e:
+        voce.update(stato="errore", risultato=f"❌ {type(e).__name__}: {e}")
+    voce["secondi"] = round(time.monotonic() - inizio, 3)
+    return voce
+
+
+def esegui_batch(sorgente, output, concorrenza=4, rpm=60, riprendi=True, cache=None):
+    completati = leggi_completati(output) if riprendi else set()
+    tutti = list(elenca_lavori(sorgente))
+    lavori = [(i, p) for i, p in tutti if i not in completati]
+    limitatore = LimitatoreRichieste(rpm)
+    # Solo i lavori di questa sorgente gia' nel checkpoint, non ogni sua riga
+    conteggi = {"ok": 0, "errore": 0, "saltati": len(tutti) - len(lavori)}
+
+    with open(output, "a" if riprendi else "w", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=concorrenza) as pool:
+        futures = [pool.submit(analizza_file, i, p, cache, limitatore) for i, p in lavori]
+        for future in as_completed(futures):
+            voce = future.result()
+            out.write(json.dumps(voce, ensure_ascii=False) + "\n")
+            out.flush()
+            conteggi[voce["stato"]] += 1
+            print(f"[{voce['stato']}] {voce['id']} ({voce['secondi']}s)", file=sys.stderr)
+    return conteggi
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analisi batch di referti del sangue.")
+    parser.add_argument("sorgente", help="cartella di PDF/immagini oppure manifest JSONL")
+    parser.add_argument("-o", "--output", default="risultati.jsonl")
+    parser.add_argument("--concorrenza", type=int, default=4)
+    parser.add_argument("--rpm", type=float, default=60, help="richieste al minuto verso Gemini (0 = nessun limite)")
+    parser.add_argument("--ricomincia", action="store_true", help="ignora il checkpoint e riscrive l'output")
+    parser.add_argument("--senza-cache", action="store_true")
+    args = parser.parse_args(argv)
+
+    load_dotenv()
+    configura_gemini()
+    cache = None if args.senza_cache else CacheRisultati()
+    conteggi = esegui_batch(
+        args.sorgente, args.output,
+        concorrenza=args.concorrenza, rpm=args.rpm,
+        riprendi=not args.ricomincia, cache=cache,
+    )
+    registro.scrivi_su_file()
+    print(f"Completati: {conteggi['ok']}, errori: {conteggi['errore']}, "
+          f"gia' presenti: {conteggi['saltati']}", file=sys.stderr)
+    return 0 if conteggi["errore"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
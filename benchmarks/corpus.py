@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# CORPUS SINTETICO DI REFERTI
+# ==================================================
+# Referti del sangue italiani generati in modo deterministico: PDF con
+# intestazione e pie' di pagina ripetuti (come quelli reali) e foto
+# simulate di varie dimensioni. Nessun dato reale di pazienti.
+
+import io
+import random
+
+from PIL import Image, ImageDraw
+
+ANALITI = [
+    ("EMOGLOBINA", "g/dL", 12.0, 16.0),
+    ("EMATOCRITO", "%", 36.0, 46.0),
+    ("GLOBULI ROSSI", "10^6/uL", 4.2, 5.4),
+    ("GLOBULI BIANCHI", "10^3/uL", 4.0, 10.0),
+    ("PIASTRINE", "10^3/uL", 150.0, 450.0),
+    ("GLUCOSIO", "mg/dL", 70.0, 100.0),
+    ("CREATININA", "mg/dL", 0.6, 1.2),
+    ("AZOTEMIA", "mg/dL", 15.0, 45.0),
+    ("COLESTEROLO TOTALE", "mg/dL", 0.0, 200.0),
+    ("COLESTEROLO HDL", "mg/dL", 40.0, 90.0),
+    ("COLESTEROLO LDL", "mg/dL", 0.0, 130.0),
+    ("TRIGLICERIDI", "mg/dL", 0.0, 150.0),
+    ("AST (GOT)", "U/L", 5.0, 40.0),
+    ("ALT (GPT)", "U/L", 5.0, 41.0),
+    ("GAMMA GT", "U/L", 8.0, 61.0),
+    ("FERRITINA", "ng/mL", 30.0, 400.0),
+    ("SIDEREMIA", "ug/dL", 60.0, 160.0),
+    ("TSH", "uUI/mL", 0.4, 4.0),
+    ("VITAMINA B12", "pg/mL", 200.0, 900.0),
+    ("VITAMINA D 25-OH", "ng/mL", 30.0, 100.0),
+]
+
+INTESTAZIONE = [
+    "LABORATORIO ANALISI CLINICHE SALUS S.R.L.",
+    "Via Giuseppe Garibaldi 12, 20121 Milano - Tel. 02 1234567",
+    "www.laboratoriosalus.it - P.IVA 01234567890",
+    "Paziente: ROSSI MARIO   Nato il: 01/01/1970   Data prelievo: 15/03/2026",
+]
+PIE_DI_PAGINA = [
+    "Documento firmato digitalmente ai sensi del D.Lgs 82/2005",
+    "Direttore del laboratorio: Dott. G. Bianchi",
+]
+
+DIMENSIONI_PDF = {"piccolo": 1, "medio": 5, "grande": 30, "molto_grande": 60}
+DIMENSIONI_IMMAGINE = {"1mp": (1280, 800), "5mp": (2592, 1944), "12mp": (4032, 3024)}
+
+
+def _numero(valore):
+    return f"{valore:.1f}".replace(".", ",")
+
+
+def righe_analiti(rng, n):
+    righe = []
+    for nome, unita, minimo, massimo in rng.sample(ANALITI, min(n, len(ANALITI))):
+        ampiezza = (massimo - minimo) or massimo
+        valore = rng.uniform(minimo - 0.3 * ampiezza, massimo + 0.3 * ampiezza)
+        valore = max(valore, 0.1)
+        flag = " *" if not minimo <= valore <= massimo else ""
+        righe.append(f"{nome} {_numero(valore)}{flag} {unita} {_numero(minimo)} - {_numero(massimo)}")
+    return righe
+
+
+def testo_pagine(n_pagine, seed=0):
+    rng = random.Random(seed)
+    pagine = []
+    for numero in range(1, n_pagine + 1):
+        righe = list(INTESTAZIONE)
+        righe.append(f"Pagina {numero} di {n_pagine}")
+        righe.extend(righe_analiti(rng, 14))
+        if numero == n_pagine:
+            righe.append("Nota: campione lievemente emolizzato")
+        righe.extend(PIE_DI_PAGINA)
+        pagine.append(righe)
+    return pagine
+
+
+def _escape_pdf(testo):
+    return testo.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def crea_pdf(pagine):
+    # PDF minimale scritto a mano (font Helvetica standard, un flusso per pagina)
+    oggetti = []
+    n = len(pagine)
+    font = 3 + 2 * n
+    figli = " ".join(f"{3 + 2 * i} 0 R" for i in range(n))
+    oggetti.append("<< /Type /Catalog /Pages 2 0 R >>")
+    oggetti.append(f"<< /Type /Pages /Kids [{figli}] /Count {n} >>")
+    for i, righe in enumerate(pagine):
+        testo = " ".join(f"({_escape_pdf(r)}) '" for r in righe)
+        flusso = f"BT /F1 9 Tf 36 806 Td 13 TL {testo} ET"
+        oggetti.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font} 0 R >> >> >>"
+        )
+        oggetti.append(f"<< /Length {len(flusso)} >>\nstream\n{flusso}\nendstream")
+    oggetti.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offset = []
+    for numero, oggetto in enumerate(oggetti, 1):
+        offset.append(out.tell())
+        out.write(f"{numero} 0 obj\n{oggetto}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(oggetti) + 1}\n0000000000 65535 f \n".encode())
+    for o in offset:
+        out.write(f"{o:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(oggetti) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    return out.getvalue()
+
+
+def crea_immagine(dimensioni, seed=0):
+    # "Foto" di un referto: testo scuro su fondo chiaro con rumore, salvata
+    # in JPEG ad alta qualita' come farebbe uno smartphone
+    rng = random.Random(seed)
+    larghezza, altezza = dimensioni
+    immagine = Image.effect_noise(dimensioni, 12).point(lambda p: 215 + p // 8).convert("RGB")
+    disegno = ImageDraw.Draw(immagine)
+    passo = max(14, altezza // 45)
+    y = passo * 2
+    for riga in INTESTAZIONE + righe_analiti(rng, 20) + PIE_DI_PAGINA:
+        disegno.text((larghezza // 12, y), riga, fill=(20, 20, 20))
+        y += passo
+    buffer = io.BytesIO()
+    immagine.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def genera_corpus(seed=0):
+    corpus = {}
+    for nome, pagine in DIMENSIONI_PDF.items():
+        corpus[f"pdf_{nome}"] = ("testo", crea_pdf(testo_pagine(pagine, seed)))
+    for nome, dimensioni in DIMENSIONI_IMMAGINE.items():
+        corpus[f"img_{nome}"] = ("immagine", crea_immagine(dimensioni, seed))
+    return corpus
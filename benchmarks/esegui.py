@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# BENCHMARK OFFLINE
+# ==================================================
+# Misura, senza consumare quota API:
+#   - throughput di estrazione di estrai_testo_da_pdf
+#   - percentili di latenza di analizza_referto_medico (con retry reali)
+#     contro il modello finto, con e senza streaming
+#   - picco di memoria Python per referto sull'intera pipeline
+#
+# Uso:
+#   python -m benchmarks.esegui                       # stampa e salva i risultati
+#   python -m benchmarks.esegui --salva-baseline      # aggiorna la baseline
+#   python -m benchmarks.esegui --confronta           # esce con 1 se ci sono regressioni
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import analisi
+from benchmarks.corpus import genera_corpus
+from benchmarks.gemini_finto import ConfigFinta, installa_modello_finto
+from estrazione_pdf import estrai_testo_da_pdf
+
+CARTELLA = os.path.dirname(os.path.abspath(__file__))
+RISULTATI_PATH = os.path.join(CARTELLA, "risultati.json")
+BASELINE_PATH = os.path.join(CARTELLA, "baseline.json")
+
+# Una metrica peggiora di oltre questa frazione rispetto alla baseline = regressione
+TOLLERANZA = 0.25
+
+
+def _percentili(campioni):
+    ms = np.asarray(campioni) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p90_ms": round(float(np.percentile(ms, 90)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def bench_estrazione(corpus, ripetizioni):
+    risultati = {}
+    for nome, (tipo, dati) in corpus.items():
+        if tipo != "testo":
+            continue
+        estrai_testo_da_pdf(dati)  # riscaldamento (import, pool)
+        tempi = []
+        for _ in range(ripetizioni):
+            inizio = time.perf_counter()
+            testo = estrai_testo_da_pdf(dati)
+            tempi.append(time.perf_counter() - inizio)
+        mediana = float(np.median(tempi))
+        pagine = testo.count("Pagina ") if testo else 0
+        risultati[nome] = {
+            "pagine": pagine,
+            "mediana_ms": round(mediana * 1000, 2),
+            "pagine_al_secondo": round(pagine / mediana, 1),
+            "mb_al_secondo": round(len(dati) / 1e6 / mediana, 2),
+        }
+    return risultati
+
+
+def bench_latenza(corpus, chiamate, config):
+    contenuto = analisi.contenuto_da_testo(estrai_testo_da_pdf(corpus["pdf_medio"][1]))
+    risultati = {}
+    with installa_modello_finto(config) as modelli:
+        tempi = []
+        for _ in range(chiamate):
+            inizio = time.perf_counter()
+            analisi.analizza_referto_medico(contenuto, "testo")
+            tempi.append(time.perf_counter() - inizio)
+        risultati["blocking"] = _percentili(tempi)
+
+        primo, totale = [], []
+        for _ in range(chiamate):
+            inizio = time.perf_counter()
+            primo_chunk = None
+            for _parte in analisi.analizza_referto_medico_stream(contenuto, "testo"):
+                if primo_chunk is None:
+                    primo_chunk = time.perf_counter() - inizio
+            totale.append(time.perf_counter() - inizio)
+            primo.append(primo_chunk)
+        risultati["streaming_primo_chunk"] = _percentili(primo)
+        risultati["streaming_totale"] = _percentili(totale)
+        risultati["chiamate_al_modello"] = sum(m.chiamate for m in modelli)
+    return risultati
+
+
+def bench_memoria(corpus, config):
+    # Nota: i worker del pool di estrazione sono processi separati e non
+    # rientrano nel conteggio di tracemalloc
+    risultati = {}
+    with installa_modello_finto(config):
+        for nome, (tipo, dati) in corpus.items():
+            tracemalloc.start()
+            analisi.analizza_dati(dati, tipo)
+            _, picco = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            risultati[nome] = {"input_byte": len(dati), "picco_byte": picco}
+    return risultati
+
+
+def esegui(ripetizioni=5, chiamate=40, seed=0):
+    corpus = genera_corpus(seed)
+    config = ConfigFinta(latenza=0.05, jitter=0.02, prob_errore=0.1, seed=seed)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "piattaforma": platform.platform(),
+            "cpu": os.cpu_count(),
+            "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "modello_finto": config.__dict__,
+        },
+        "estrazione": bench_estrazione(corpus, ripetizioni),
+        "latenza": bench_latenza(corpus, chiamate, ConfigFinta(**config.__dict__)),
+        "memoria": bench_memoria(corpus, ConfigFinta(latenza=0.0, jitter=0.0, seed=seed)),
+    }
+
+
+def _appiattisci(dati, prefisso=""):
+    piatti = {}
+    for chiave, valore in dati.items():
+        nome = f"{prefisso}{chiave}"
+        if isinstance(valore, dict):
+            piatti.update(_appiattisci(valore, nome + "."))
+        elif isinstance(valore, (int, float)) and not isinstance(valore, bool):
+            piatti[nome] = valore
+    return piatti
+
+
+def confronta(risultati, baseline, tolleranza=TOLLERANZA):
+    attuali = _appiattisci({k: v for k, v in risultati.items() if k != "meta"})
+    riferimento = _appiattisci({k: v for k, v in baseline.items() if k != "meta"})
+    regressioni = []
+    for nome, valore in sorted(attuali.items()):
+        base = riferimento.get(nome)
+        if not base:
+            continue
+        if nome.endswith(("_ms", "_byte")) and not nome.endswith("input_byte"):
+            peggiorata = valore > base * (1 + tolleranza)
+        elif nome.endswith("_al_secondo"):
+            peggiorata = valore < base * (1 - tolleranza)
+        else:
+            continue
+        if peggiorata:
+            regressioni.append(f"{nome}: {base} -> {valore}")
+    return regressioni
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline della pipeline di analisi.")
+    parser.add_argument("--ripetizioni", type=int, default=5)
+    parser.add_argument("--chiamate", type=int, default=40)
+    parser.add_argument("--output", default=RISULTATI_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--salva-baseline", action="store_true")
+    parser.add_argument("--confronta", action="store_true")
+    args = parser.parse_args(argv)
+
+    risultati = esegui(args.ripetizioni, args.chiamate)
+    testo = json.dumps(risultati, indent=2, ensure_ascii=False)
+    print(testo)
+    with open(args.output, "w", encoding="utf-8") as file:
+        file.write(testo + "\n")
+    if args.salva_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            file.write(testo + "\n")
+
+    if args.confronta:
+        if not os.path.exists(args.baseline):
+            print(f"Baseline non trovata: {args.baseline}", file=sys.stderr)
+            return 2
+        with open(args.baseline, encoding="utf-8") as file:
+            regressioni = confronta(risultati, json.load(file))
+        for riga in regressioni:
+            print(f"REGRESSIONE {riga}", file=sys.stderr)
+        return 1 if regressioni else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# SOSTITUTO LOCALE DI genai.GenerativeModel
+# ==================================================
+# Modello deterministico per benchmark e prove offline: latenza
+# configurabile, streaming a pezzi e iniezione di errori (quota, 5xx,
+# risposte vuote o bloccate). Nessuna chiamata di rete.
+
+import contextlib
+import random
+import time
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+from google.api_core import exceptions
+
+REPORT_FINTO = """**📊 1. Valori Fuori Norma:**
+*   Glucosio | 112 mg/dL | 70 - 100
+
+**⚠️ 2. Spiegazione Semplificata:**
+*   Valori alti di glucosio potrebbero indicare un digiuno non rispettato.
+
+**🩺 3. Note dal Referto:**
+*   Nessuna nota.
+
+**💡 4. Consigli Generici (Stile di Vita):**
+*   Bere acqua a sufficienza e dormire 7-8 ore."""
+
+ERRORI = {
+    "quota": lambda: exceptions.ResourceExhausted("Quota exceeded. Please retry in 0.1s"),
+    "5xx": lambda: exceptions.ServiceUnavailable("Service unavailable"),
+    "timeout": lambda: exceptions.DeadlineExceeded("Deadline exceeded"),
+}
+
+
+@dataclass
+class ConfigFinta:
+    latenza: float = 0.05
+    # Variazione casuale (+/-) della latenza, deterministica grazie al seed
+    jitter: float = 0.02
+    # Tempo fra un pezzo e l'altro in streaming
+    latenza_chunk: float = 0.005
+    dimensione_chunk: int = 40
+    prob_errore: float = 0.0
+    tipi_errore: tuple = ("5xx", "quota")
+    prob_vuota: float = 0.0
+    prob_bloccata: float = 0.0
+    seed: int = 0
+
+
+def _finish_reason(nome):
+    return SimpleNamespace(name=nome)
+
+
+def _risposta(testo, token_input, bloccata=False, finish="STOP"):
+    return SimpleNamespace(
+        text=testo,
+        prompt_feedback=SimpleNamespace(block_reason="SAFETY" if bloccata else None),
+        candidates=[SimpleNamespace(finish_reason=_finish_reason(finish))],
+        usage_metadata=SimpleNamespace(
+            prompt_token_count=token_input,
+            candidates_token_count=(len(testo) + 3) // 4,
+        ),
+    )
+
+
+class ModelloFinto:
+    def __init__(self, nome, config=None):
+        self.nome = nome
+        self.config = config or ConfigFinta()
+        self._rng = random.Random(self.config.seed)
+        self.chiamate = 0
+
+    def _dimensione(self, contents):
+        if isinstance(contents, str):
+            return len(contents)
+        return sum(len(p) if isinstance(p, str) else len(p.get("data", b"")) for p in contents)
+
+    def _attendi(self):
+        c = self.config
+        time.sleep(max(0.0, c.latenza + self._rng.uniform(-c.jitter, c.jitter)))
+
+    def generate_content(self, contents, safety_settings=None, stream=False,
+                         request_options=None, **_):
+        self.chiamate += 1
+        c = self.config
+        token_input = (self._dimensione(contents) + 3) // 4
+        self._attendi()
+
+        sorteggio = self._rng.random()
+        if sorteggio < c.prob_errore:
+            raise ERRORI[self._rng.choice(c.tipi_errore)]()
+        sorteggio -= c.prob_errore
+        if sorteggio < c.prob_bloccata:
+            risposta = _risposta("", token_input, bloccata=True)
+            return iter([risposta]) if stream else risposta
+        sorteggio -= c.prob_bloccata
+        testo = "" if sorteggio < c.prob_vuota else REPORT_FINTO
+
+        if not stream:
+            return _risposta(testo, token_input)
+        return self._stream(testo, token_input)
+
+    def _stream(self, testo, token_input):
+        c = self.config
+        pezzi = [testo[i:i + c.dimensione_chunk] for i in range(0, len(testo), c.dimensione_chunk)] or [""]
+        for indice, pezzo in enumerate(pezzi):
+            if indice:
+                time.sleep(c.latenza_chunk)
+            yield _risposta(pezzo, token_input)
+
+
+@contextlib.contextmanager
+def installa_modello_finto(config=None):
+    # Sostituisce il modello usato da analisi.py per tutta la durata del blocco
+    import analisi
+
+    originale = analisi.genai.GenerativeModel
+    modelli = []
+
+    def fabbrica(nome, *args, **kwargs):
+        modello = ModelloFinto(nome, config)
+        modelli.append(modello)
+        return modello
+
+    analisi.genai.GenerativeModel = fabbrica
+    analisi.get_model.cache_clear()
+    analisi.circuito_gemini.registra_successo()
+    try:
+        yield modelli
+    finally:
+        analisi.genai.GenerativeModel = originale
+        analisi.get_model.cache_clear()
+        analisi.circuito_gemini.registra_successo()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# CACHE PERSISTENTE DEI RISULTATI
+# ==================================================
+# Cache su disco (SQLite) indicizzata per contenuto: la chiave e' l'hash
+# dei byte caricati + versione del prompt + modello. Il file e' condiviso
+# tra sessioni Streamlit e processi diversi (SQLite gestisce i lock).
+
+import hashlib
+import os
+import sqlite3
+import time
+
+CACHE_PATH = os.getenv("REFERTI_CACHE_PATH", os.path.join(".cache", "referti.sqlite3"))
+CACHE_TTL_SECONDI = int(os.getenv("REFERTI_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MAX_VOCI = int(os.getenv("REFERTI_CACHE_MAX_VOCI", "2000"))
+CACHE_MAX_BYTE = int(os.getenv("REFERTI_CACHE_MAX_BYTE", str(50 * 1024 * 1024)))
+
+
+def calcola_chiave(dati, tipo_contenuto, model_name, prompt_version):
+    if isinstance(dati, str):
+        dati = dati.encode("utf-8")
+    h = hashlib.sha256()
+    for parte in (prompt_version, model_name, tipo_contenuto):
+        h.update(str(parte).encode("utf-8"))
+        h.update(b"\x00")
+    h.update(hashlib.sha256(dati).digest())
+    return h.hexdigest()
+
+
+class CacheRisultati:
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL_SECONDI,
+                 max_voci=CACHE_MAX_VOCI, max_byte=CACHE_MAX_BYTE):
+        self.path = path
+        self.ttl = ttl
+        self.max_voci = max_voci
+        self.max_byte = max_byte
+        cartella = os.path.dirname(path)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        with self._connetti() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS risultati ("
+                " chiave TEXT PRIMARY KEY,"
+                " valore TEXT NOT NULL,"
+                " creato REAL NOT NULL,"
+                " ultimo_accesso REAL NOT NULL,"
+                " dimensione INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_risultati_accesso"
+                " ON risultati (ultimo_accesso)"
+            )
+
+    def _connetti(self):
+        # Una connessione per operazione: Streamlit serve le sessioni da
+        # thread diversi e le connessioni sqlite3 non vanno condivise.
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, chiave):
+        adesso = time.time()
+        with self._connetti() as conn:
+            riga = conn.execute(
+                "SELECT valore, creato FROM risultati WHERE chiave = ?", (chiave,)
+            ).fetchone()
+            if riga is None:
+                return None
+            valore, creato = riga
+            if self.ttl and adesso - creato > self.ttl:
+                conn.execute("DELETE FROM risultati WHERE chiave = ?", (chiave,))
+                return None
+            conn.execute(
+                "UPDATE risultati SET ultimo_accesso = ? WHERE chiave = ?",
+                (adesso, chiave),
+            )
+            return valore
+
+    def set(self, chiave, valore):
+        adesso = time.time()
+        dimensione = len(valore.encode("utf-8"))
+        if self.max_byte and dimensione > self.max_byte:
+            return
+        with self._connetti() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO risultati"
+                " (chiave, valore, creato, ultimo_accesso, dimensione)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (chiave, valore, adesso, adesso, dimensione),
+            )
+            self._evict(conn, adesso)
+
+    def _evict(self, conn, adesso):
+        if self.ttl:
+            conn.execute("DELETE FROM risultati WHERE creato < ?", (adesso - self.ttl,))
+        voci, totale = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(dimensione), 0) FROM risultati"
+        ).fetchone()
+        if voci <= self.max_voci and totale <= self.max_byte:
+            return
+        # LRU: si scartano le voci meno usate finche' non si rientra nei limiti
+        righe = conn.execute(
+            "SELECT chiave, dimensione FROM risultati ORDER BY ultimo_accesso ASC"
+        ).fetchall()
+        da_eliminare = []
+        for chiave, dimensione in righe:
+            if voci <= self.max_voci and totale <= self.max_byte:
+                break
+            da_eliminare.append((chiave,))
+            voci -= 1
+            totale -= dimensione
+        conn.executemany("DELETE FROM risultati WHERE chiave = ?", da_eliminare)
+
+    def svuota(self):
+        with self._connetti() as conn:
+            conn.execute("DELETE FROM risultati")
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# COMPATTAZIONE DEL TESTO PRIMA DEL PROMPT
+# ==================================================
+# Nei referti multipagina gran parte dei token e' rumore: carta intestata,
+# indirizzi, intestazioni e pie' di pagina ripetuti su ogni pagina, note
+# legali. Qui si rimuove cio' che non serve all'analisi e si riportano i
+# token stimati prima e dopo.
+
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+from parser_valori import analizza_riga, analizza_riga_senza_riferimento
+
+# Una riga presente in almeno questa frazione di pagine e' un'intestazione
+SOGLIA_RIPETIZIONE = 0.5
+
+_RE_BOILERPLATE = re.compile(
+    r"""(
+        \b(tel|telefono|fax|cell)\b\.?\s*[:.]?\s*[\d+]
+      | @\S+\.\w+ | \bwww\.\S+ | https?://
+      | \bp\.?\s*iva\b | \bc\.?\s*f\.?\s*[:.]?\s*\w{11,16}\b | \bcodice\s+fiscale\b
+      | \bpag(ina|\.)?\s*\d+\s*(di|/)\s*\d+\b
+      | \bfirmat[oa]\s+digitalmente\b | \bfirma\s+(del|digitale)\b
+      | \bd\.?\s*lgs\.?\b | \bgdpr\b | \bprivacy\b | \breg\.?\s*ue\b
+      | \bautorizzazione\s+sanitaria\b | \baccreditat[oa]\b | \bcertificat[oa]\s+iso\b
+      | \bdirettore\s+(sanitario|del\s+laboratorio)\b | \bresponsabile\s+(del\s+)?laboratorio\b
+      | \bvia\s+[\w'. ]+,?\s*\d+.*\b\d{5}\b
+      | \bcap\s*\d{5}\b
+      | \bstampato\s+il\b | \bdata\s+(di\s+)?stampa\b
+    )""",
+    re.IGNORECASE | re.VERBOSE,
+)
+
+_RE_NOTE = re.compile(r"^\s*(nota|note|n\.\s*b\.|commento|commenti|osservazioni|interpretazione)\b", re.IGNORECASE)
+_RE_SPAZI = re.compile(r"[ \t ]+")
+_RE_CIFRE = re.compile(r"\d+")
+# Celle di tabella su righe proprie (PyPDF2): "13,5", "12,0 - 16,0", "< 5", "H"
+_RE_SOLO_VALORI = re.compile(r"^[\d\s.,:;<>=≤≥+\-–/%*()^HLhl]*\d[\d\s.,:;<>=≤≥+\-–/%*()^HLhl]*$")
+
+
+@dataclass
+class RisultatoCompattazione:
+    testo: str
+    token_prima: int
+    token_dopo: int
+    righe_prima: int
+    righe_dopo: int
+
+    def riepilogo(self):
+        if not self.token_prima:
+            return "0 token"
+        risparmio = 100 * (1 - self.token_dopo / self.token_prima)
+        return f"~{self.token_prima} → ~{self.token_dopo} token (-{risparmio:.0f}%)"
+
+
+def stima_token(testo):
+    # Stima economica (~4 caratteri per token), sufficiente per confronti
+    # prima/dopo senza una chiamata count_tokens all'API
+    return (len(testo) + 3) // 4
+
+
+def normalizza_riga(riga):
+    return _RE_SPAZI.sub(" ", riga).strip()
+
+
+def _firma_riga(riga):
+    # "Pagina 2 di 5" e "Pagina 3 di 5" devono risultare la stessa riga; le
+    # altre righe si confrontano sul testo esatto, cifre comprese
+    if e_boilerplate(riga):
+        return _RE_CIFRE.sub("#", riga.lower())
+    return riga
+
+
+def riga_di_dati(riga):
+    # Righe di esami (con o senza range) e celle numeriche: mai scartate
+    return (bool(_RE_SOLO_VALORI.match(riga)) or analizza_riga(riga) is not None
+            or analizza_riga_senza_riferimento(riga) is not None)
+
+
+def righe_ripetute(pagine, soglia=SOGLIA_RIPETIZIONE):
+    if len(pagine) < 2:
+        return set()
+    conteggi = Counter()
+    for pagina in pagine:
+        conteggi.update({_firma_riga(normalizza_riga(r)) for r in pagina.splitlines() if r.strip()})
+    minimo = max(2, int(len(pagine) * soglia + 0.5))
+    return {firma for firma, n in conteggi.items() if n >= minimo}
+
+
+def e_boilerplate(riga):
+    return bool(_RE_BOILERPLATE.search(riga))
+
+
+def compatta_pagine(pagine, solo_analiti=False, conta_token=stima_token):
+    originale = "\n".join(pagine)
+    ripetute = righe_ripetute(pagine)
+    ripetute_viste = set()
+    tenute = []
+    for pagina in pagine:
+        for riga in pagina.splitlines():
+            riga = normalizza_riga(riga)
+            if not riga:
+                continue
+            # Le righe di esami e i valori non vengono mai scartati, anche se
+            # ripetuti: due celle "4,1" consecutive sono due valori distinti
+            if _RE_SOLO_VALORI.match(riga):
+                tenute.append(riga)
+                continue
+            if not riga_di_dati(riga):
+                # Le note del laboratorio servono all'analisi anche quando
+                # contengono parole da carta intestata ("accreditato")
+                nota = bool(_RE_NOTE.match(riga))
+                firma = _firma_riga(riga)
+                if firma in ripetute:
+                    # Intestazioni ripetute su ogni pagina (paziente, sesso/eta',
+                    # data del prelievo, note) servono al modello: si tiene
+                    # la prima occorrenza e si scartano le copie
+                    if firma in ripetute_viste:
+                        continue
+                    ripetute_viste.add(firma)
+                if not nota and e_boilerplate(riga):
+                    continue
+                if solo_analiti and not nota:
+                    continue
+            # Righe identiche consecutive (es. a cavallo di pagina) una volta sola
+            if tenute and tenute[-1] == riga:
+                continue
+            tenute.append(riga)
+
+    testo = "\n".join(tenute)
+    return RisultatoCompattazione(
+        testo=testo,
+        token_prima=conta_token(originale),
+        token_dopo=conta_token(testo),
+        righe_prima=sum(1 for r in originale.splitlines() if r.strip()),
+        righe_dopo=len(tenute),
+    )
+
+
+def compatta_testo(testo, solo_analiti=False, conta_token=stima_token):
+    # Variante per testo gia' unito: senza pagine non si cercano ripetizioni
+    return compatta_pagine([testo], solo_analiti=solo_analiti, conta_token=conta_token)
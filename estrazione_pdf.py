@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# ESTRAZIONE TESTO DA PDF
+# ==================================================
+# Lettura direttamente dal buffer caricato (nessun file temporaneo).
+# I referti lunghi vengono estratti pagina per pagina su un pool di
+# processi; le pagine che falliscono o vanno in timeout sono riportate
+# in RisultatoEstrazione.pagine_fallite invece di essere ignorate.
+
+import io
+import math
+import multiprocessing
+import os
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import PyPDF2
+
+# Sotto questa soglia il costo di avvio del pool supera il guadagno
+SOGLIA_PARALLELO = 8
+
+
+def contesto_processi():
+    # Streamlit e FastAPI chiamano da thread: fork di un processo con piu'
+    # thread puo' bloccare il figlio su un lock ereditato. forkserver
+    # (spawn dove non esiste) parte da un processo pulito
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    contesto = multiprocessing.get_context("forkserver")
+    # I worker nascono con PyPDF2 gia' importato
+    contesto.set_forkserver_preload([__name__])
+    return contesto
+
+
+@dataclass
+class RisultatoEstrazione:
+    testo: Optional[str]
+    pagine: List[str] = field(default_factory=list)
+    pagine_totali: int = 0
+    pagine_estratte: int = 0
+    pagine_fallite: List[Tuple[int, str]] = field(default_factory=list)
+    errore: Optional[str] = None
+    # Testo di ogni pagina nell'ordine originale (None = estrazione fallita)
+    testi: List[Optional[str]] = field(default_factory=list)
+
+
+def _leggi_byte(sorgente):
+    if isinstance(sorgente, (bytes, bytearray, memoryview)):
+        return bytes(sorgente)
+    if hasattr(sorgente, "getvalue"):
+        return sorgente.getvalue()
+    if hasattr(sorgente, "read"):
+        return sorgente.read()
+    with open(sorgente, "rb") as file:
+        return file.read()
+
+
+def _apri_lettore(dati):
+    lettore = PyPDF2.PdfReader(io.BytesIO(dati))
+    if lettore.is_encrypted:
+        # Molti referti sono "cifrati" con password vuota solo per bloccare la stampa
+        if not lettore.decrypt(""):
+            raise ValueError("PDF protetto da password")
+    return lettore
+
+
+# Stato del processo worker: il PDF viene aperto una sola volta per processo
+_lettore_worker = None
+
+
+def _inizializza_worker(dati):
+    global _lettore_worker
+    _lettore_worker = _apri_lettore(dati)
+
+
+def _estrai_pagina_worker(indice):
+    return _lettore_worker.pages[indice].extract_text() or ""
+
+
+def _estrai_sequenziale(lettore, n_pagine, risultato):
+    testi = [None] * n_pagine
+    for indice in range(n_pagine):
+        try:
+            testi[indice] = lettore.pages[indice].extract_text() or ""
+        except Exception as e:
+            risultato.pagine_fallite.append((indice, str(e) or type(e).__name__))
+    return testi
+
+
+def _estrai_parallelo(dati, n_pagine, timeout_pagina, max_worker, risultato):
+    testi = [None] * n_pagine
+    max_worker = max_worker or min(n_pagine, os.cpu_count() or 1)
+    # multiprocessing.Pool e non ProcessPoolExecutor: terminate() ferma
+    # anche i worker bloccati su una pagina, che altrimenti resterebbero vivi
+    pool = contesto_processi().Pool(max_worker, initializer=_inizializza_worker, initargs=(dati,))
+    try:
+        attese = [pool.apply_async(_estrai_pagina_worker, (i,)) for i in range(n_pagine)]
+        # Scadenza unica per tutto il pool: i timeout delle singole pagine non
+        # si sommano quando piu' pagine restano bloccate
+        fine = None
+        if timeout_pagina is not None:
+            fine = time.monotonic() + timeout_pagina * math.ceil(n_pagine / max_worker)
+        for indice, attesa in enumerate(attese):
+            try:
+                rimanente = None if fine is None else max(0.0, fine - time.monotonic())
+                testi[indice] = attesa.get(timeout=rimanente)
+            except multiprocessing.TimeoutError:
+                risultato.pagine_fallite.append((indice, "timeout"))
+            except Exception as e:
+                risultato.pagine_fallite.append((indice, str(e) or type(e).__name__))
+    finally:
+        # A questo punto ogni pagina ha un esito: i worker ancora occupati
+        # sono bloccati oltre il timeout e vengono chiusi
+        pool.terminate()
+        pool.join()
+    return testi
+
+
+def estrai_pagine_pdf(sorgente, max_pagine=None, timeout_pagina=None, max_worker=None,
+                      parallelo=None):
+    dati = _leggi_byte(sorgente)
+    try:
+        lettore = _apri_lettore(dati)
+        n_pagine = len(lettore.pages)
+    except Exception as e:
+        return RisultatoEstrazione(testo=None, errore=str(e) or type(e).__name__)
+
+    risultato = RisultatoEstrazione(testo=None, pagine_totali=n_pagine)
+    if max_pagine is not None:
+        n_pagine = min(n_pagine, max_pagine)
+
+    if parallelo is None:
+        # Con una sola CPU il pool aggiunge solo overhead; con un timeout serve
+        # comunque, perche' solo un processo separato si puo' interrompere
+        parallelo = timeout_pagina is not None or (
+            n_pagine >= SOGLIA_PARALLELO and (max_worker or os.cpu_count() or 1) > 1
+        )
+    if parallelo and n_pagine > 0:
+        testi = _estrai_parallelo(dati, n_pagine, timeout_pagina, max_worker, risultato)
+    else:
+        testi = _estrai_sequenziale(lettore, n_pagine, risultato)
+
+    pagine_valide = [t for t in testi if t]
+    risultato.testi = testi
+    risultato.pagine = pagine_valide
+    risultato.pagine_estratte = sum(1 for t in testi if t is not None)
+    # join unico: niente concatenazioni ripetute sulla stringa
+    testo = "\n".join(pagine_valide)
+    risultato.testo = testo + "\n" if testo.strip() else None
+    return risultato
+
+
+def estrai_testo_da_pdf(sorgente, **opzioni):
+    return estrai_pagine_pdf(sorgente, **opzioni).testo
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# PRE-ELABORAZIONE IMMAGINI
+# ==================================================
+# Le foto da smartphone (12+ megapixel) vengono ridotte prima dell'invio
+# a Gemini: orientamento EXIF, scala di grigi, ridimensionamento sul lato
+# lungo, ritaglio opzionale dei margini e ricompressione JPEG entro un
+# budget di byte. Meno byte = upload piu' veloce e meno token immagine.
+
+import io
+from dataclasses import dataclass
+from typing import Optional
+
+from PIL import Image, ImageOps
+
+
+@dataclass
+class ConfigImmagine:
+    correggi_orientamento: bool = True
+    scala_di_grigi: bool = True
+    lato_lungo_max: int = 2000
+    ritaglio_margini: bool = False
+    # Pixel piu' chiari di questa soglia sono considerati sfondo bianco
+    soglia_margini: int = 235
+    padding_margini: int = 16
+    budget_byte: int = 600 * 1024
+    qualita_iniziale: int = 85
+    qualita_minima: int = 45
+    lato_miniatura: int = 640
+
+
+@dataclass
+class RisultatoImmagine:
+    dati: bytes
+    immagine: Image.Image
+    mime_type: str
+    byte_originali: int
+    byte_finali: int
+    dimensioni_originali: tuple
+    dimensioni_finali: tuple
+    qualita: Optional[int]
+
+    def parte_gemini(self):
+        # Formato "blob" accettato da generate_content insieme al prompt
+        return {"mime_type": self.mime_type, "data": self.dati}
+
+    def riepilogo(self):
+        w0, h0 = self.dimensioni_originali
+        w1, h1 = self.dimensioni_finali
+        return (
+            f"{w0}x{h0} px, {self.byte_originali / 1024:.0f} KB → "
+            f"{w1}x{h1} px, {self.byte_finali / 1024:.0f} KB"
+        )
+
+
+def ritaglia_margini(immagine, soglia, padding):
+    grigio = immagine if immagine.mode == "L" else immagine.convert("L")
+    # Il contenuto (testo scuro) diventa bianco sul nero, poi getbbox
+    maschera = grigio.point(lambda p: 255 if p < soglia else 0)
+    box = maschera.getbbox()
+    if box is None:
+        return immagine
+    sx, sy, dx, dy = box
+    box = (
+        max(0, sx - padding),
+        max(0, sy - padding),
+        min(immagine.width, dx + padding),
+        min(immagine.height, dy + padding),
+    )
+    return immagine.crop(box)
+
+
+def _comprimi(immagine, qualita):
+    buffer = io.BytesIO()
+    immagine.save(buffer, format="JPEG", quality=qualita, optimize=True)
+    return buffer.getvalue()
+
+
+def ricomprimi(immagine, config):
+    # Prima si scende di qualita', poi (se non basta) si riduce la risoluzione
+    for _ in range(4):
+        qualita = config.qualita_iniziale
+        while True:
+            dati = _comprimi(immagine, qualita)
+            if len(dati) <= config.budget_byte or qualita <= config.qualita_minima:
+                break
+            qualita = max(config.qualita_minima, qualita - 10)
+        if len(dati) <= config.budget_byte:
+            break
+        immagine = immagine.resize(
+            (max(1, int(immagine.width * 0.8)), max(1, int(immagine.height * 0.8))),
+            Image.LANCZOS,
+        )
+    return immagine, dati, qualita
+
+
+def preelabora_immagine(dati_originali, config=None):
+    config = config or ConfigImmagine()
+    immagine = Image.open(io.BytesIO(dati_originali))
+    dimensioni_originali = immagine.size
+
+    if config.correggi_orientamento:
+        immagine = ImageOps.exif_transpose(immagine)
+    immagine = immagine.convert("L" if config.scala_di_grigi else "RGB")
+    if config.ritaglio_margini:
+        immagine = ritaglia_margini(immagine, config.soglia_margini, config.padding_margini)
+    if max(immagine.size) > config.lato_lungo_max:
+        # thumbnail mantiene le proporzioni e lavora in place
+        immagine.thumbnail((config.lato_lungo_max, config.lato_lungo_max), Image.LANCZOS)
+
+    immagine, dati, qualita = ricomprimi(immagine, config)
+    return RisultatoImmagine(
+        dati=dati,
+        immagine=immagine,
+        mime_type="image/jpeg",
+        byte_originali=len(dati_originali),
+        byte_finali=len(dati),
+        dimensioni_originali=dimensioni_originali,
+        dimensioni_finali=immagine.size,
+        qualita=qualita,
+    )
+
+
+def crea_miniatura(dati, lato=ConfigImmagine.lato_miniatura):
+    # Anteprima direttamente dal file caricato, senza la pre-elaborazione
+    # completa: draft() fa decodificare i JPEG gia' a scala ridotta
+    immagine = Image.open(io.BytesIO(dati))
+    immagine.draft("RGB", (lato, lato))
+    immagine = ImageOps.exif_transpose(immagine)
+    immagine.thumbnail((lato, lato))
+    return immagine
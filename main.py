@@ -5,14 +5,26 @@
 # ==================================================
 import streamlit as st
 import google.generativeai as genai
-from PIL import Image
-import PyPDF2
-import tempfile
+import contextvars
+import datetime
+import hashlib
 import os
-import time
-from google.api_core import exceptions
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import List, Optional
 from dotenv import load_dotenv
 
+from analisi import (
+    DISCLAIMER_VELOCE, MODEL_NAME, PDF_ILLEGGIBILE, PROMPT_VERSION, ContenutoPreparato,
+    analizza_contenuto, contenuto_da_referto, estrai_testo_referto, fuori_norma_non_citati,
+    prepara_contenuto, rileva_tipo, unisci_contenuti,
+)
+from cache_risultati import CacheRisultati, calcola_chiave
+from immagini import ConfigImmagine, crea_miniatura, preelabora_immagine
+from metriche import misura, registro, traccia
+from parser_valori import estrai_valori, report_veloce
+from storico import StoricoValori, tabella_confronto
+
 load_dotenv()
 
 # ==================================================
@@ -27,8 +39,6 @@ st.set_page_config(
 # ==================================================
 # CONFIGURAZIONE MODELLO (AGGIORNATO GEMINI 2.5)
 # ==================================================
-MODEL_NAME = 'gemini-2.5-flash' # <--- AGGIORNATO QUI
-
 try:
     api_key = st.secrets.get("GEMINI_API_KEY") or os.getenv("GEMINI_API_KEY")
     if not api_key:
@@ -41,88 +51,215 @@ except Exception as e:
     st.error(f"❌ Errore configurazione: {e}")
     st.stop()
 
-# Impostazioni di sicurezza RILASSATE per termini medici
-SAFETY_SETTINGS = [
-    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
-    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
-    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
-    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"},
-]
+# Pre-elaborazione delle foto prima dell'invio a Gemini
+CONFIG_IMMAGINE = ConfigImmagine()
 
-MAX_RETRIES = 2
+# Mostra la risposta di Gemini man mano che viene generata
+STREAMING_RISPOSTE = True
+
+# File caricati insieme analizzati in parallelo (estrazione + Gemini)
+MAX_FILE_PARALLELI = 4
 
 # ==================================================
 # FUNZIONI HELPER
 # ==================================================
 
-def analizza_referto_medico(contenuto, tipo_contenuto):
-    prompt = """
-    Agisci come un assistente esperto nella lettura di dati biomedici. Analizza questo referto medico (analisi del sangue) in italiano.
-    
-    **⚠️ REGOLA FONDAMENTALE:** 
-    NON FARE DIAGNOSI. Il tuo compito è solo estrarre e spiegare i dati.
-
-    Genera un report strutturato ESATTAMENTE in questi 4 punti:
-
-    **📊 1. Valori Fuori Norma:**
-    *   Elenca SOLO i valori che sono esplicitamente segnati come "fuori range" (spesso con asterischi * o grassetto).
-    *   Indica: Nome Esame | Valore Rilevato | Range di Riferimento.
-    *   Se TUTTI i valori sono nella norma, scrivilo chiaramente.
-
-    **⚠️ 2. Spiegazione Semplificata:**
-    *   Per ogni valore fuori norma identificato sopra, spiega brevemente in parole semplici a cosa si riferisce.
-    *   Usa un linguaggio condizionale: "Valori alti potrebbero indicare...", "Generalmente associato a...".
-
-    **🩺 3. Note dal Referto:**
-    *   Riporta eventuali note scritte dal laboratorio.
-
-    **💡 4. Consigli Generici (Stile di Vita):**
-    *   Fornisci 2-3 consigli molto generali sullo stile di vita (idratazione, sonno, dieta).
-    *   NON consigliare farmaci.
-    """
-
-    for tentativo in range(MAX_RETRIES):
-        try:
-            # Creiamo il modello fresco ad ogni chiamata
-            model = genai.GenerativeModel(MODEL_NAME)
-
-            if tipo_contenuto == "immagine":
-                risposta = model.generate_content([prompt, contenuto], safety_settings=SAFETY_SETTINGS)
-            else: 
-                input_content = f"{prompt}\n\n--- REFERTO ---\n{contenuto}"
-                risposta = model.generate_content(input_content, safety_settings=SAFETY_SETTINGS)
-
-            if hasattr(risposta, 'text') and risposta.text:
-                disclaimer_app = "\n\n---\n**⚠️ DISCLAIMER:** *Analisi automatica IA (Gemini 2.5). Non sostituisce il medico.*"
-                return risposta.text.strip() + disclaimer_app
-            
-            elif hasattr(risposta, 'prompt_feedback') and risposta.prompt_feedback.block_reason:
-                 return f"⚠️ Analisi bloccata dai filtri di sicurezza: {risposta.prompt_feedback.block_reason}"
-            
-            time.sleep(1)
-
-        except exceptions.GoogleAPIError as e:
-            if "not found" in str(e).lower() or "404" in str(e):
-                 return f"❌ Errore Modello: {MODEL_NAME} non trovato."
-            time.sleep(1)
-        except Exception as e:
-             return f"❌ Errore imprevisto: {str(e)}"
-
-    return "⚠️ Servizio momentaneamente non disponibile."
-
-def estrai_testo_da_pdf(pdf_file_path):
-    testo_completo = ""
+@st.cache_resource
+def get_cache_risultati():
+    return CacheRisultati()
+
+def analizza_in_area(dati_file, tipo_contenuto, produci_contenuto, area=None, cache=None):
+    # Pipeline di analisi.analizza_contenuto; se viene passata un'area
+    # (st.empty) il testo viene mostrato in streaming
+    su_parte = None
+    if area is not None:
+        parti = []
+
+        def mostra_parte(parte):
+            parti.append(parte)
+            area.markdown("".join(parti) + " ▌")
+        su_parte = mostra_parte
+
+    esito = analizza_contenuto(dati_file, tipo_contenuto, produci_contenuto,
+                               cache or get_cache_risultati(), su_parte=su_parte)
+    if area is not None:
+        area.markdown(esito.risultato)
+    return esito
+
+@st.cache_resource
+def get_storico():
+    return StoricoValori()
+
+def aggiorna_storico(paziente, data_referto, dati_file, testo):
+    # Confronto con i referti precedenti calcolato localmente, poi salvataggio
+    valori = estrai_valori(testo)
+    if not valori:
+        return None
+    storico = get_storico()
+    id_referto = hashlib.sha256(dati_file).hexdigest()
+    with misura("storico"):
+        confronti = storico.confronta(paziente, id_referto, data_referto, valori)
+        storico.salva_referto(paziente, id_referto, data_referto, valori)
+    return tabella_confronto(confronti)
+
+def mostra_confronto(confronti):
+    st.markdown("---")
+    st.subheader("📈 Confronto con i referti precedenti")
+    for nome, tabella in confronti:
+        if len(confronti) > 1:
+            st.caption(nome)
+        st.markdown(tabella)
+
+@dataclass
+class EsitoFile:
+    nome: str
+    tipo: Optional[str]  # None se il formato non e' riconosciuto
+    dati: bytes = field(default=b"", repr=False)
+    risultato: Optional[str] = None
+    errore: Optional[str] = None
+    avvisi: List[str] = field(default_factory=list)
+    note: List[str] = field(default_factory=list)
+    miniatura: object = None
+    testo: Optional[str] = None
+
+def analizza_file_caricato(esito, modalita_veloce, cache, area=None):
+    # Gira anche nei thread del pool: nessuna chiamata a Streamlit, tranne
+    # l'area di streaming (passata solo dal thread principale)
     try:
-        with open(pdf_file_path, 'rb') as file:
-            lettore_pdf = PyPDF2.PdfReader(file)
-            if lettore_pdf.is_encrypted:
-                try: lettore_pdf.decrypt('')
-                except: return None
-            for pagina in lettore_pdf.pages:
-                txt = pagina.extract_text()
-                if txt: testo_completo += txt + "\n"
-            return testo_completo if testo_completo.strip() else None
-    except: return None
+        if esito.tipo == "immagine":
+            esito.miniatura = crea_miniatura(esito.dati)
+
+            def prepara_immagine():
+                # Solo in caso di miss: su un hit la foto non viene ricompressa
+                with misura("preelaborazione_immagine"):
+                    immagine = preelabora_immagine(esito.dati, CONFIG_IMMAGINE)
+                esito.note.append(f"Immagine ottimizzata: {immagine.riepilogo()}")
+                return ContenutoPreparato(immagine.parte_gemini())
+
+            esito.risultato = analizza_in_area(esito.dati, "immagine", prepara_immagine, area, cache).risultato
+            return esito
+
+        def estrai_referto(rasterizza=True):
+            referto = estrai_testo_referto(esito.dati, rasterizza)
+            esito.avvisi.extend(referto.avvisi)
+            if referto.instradamento is not None:
+                esito.note.append(referto.instradamento.riepilogo())
+            if referto.compattazione is not None:
+                esito.note.append(f"Testo compattato: {referto.compattazione.riepilogo()}")
+            esito.testo = referto.testo
+            return referto
+
+        def estrai():
+            referto = estrai_referto()
+            return ContenutoPreparato(contenuto_da_referto(referto), parziale=referto.instradamento.parziale)
+
+        if modalita_veloce:
+            # Senza IA le pagine scansionate non servono: niente rasterizzazione
+            testo = estrai_referto(rasterizza=False).testo
+            if testo is None:
+                esito.risultato = PDF_ILLEGGIBILE
+            else:
+                esito.risultato = report_veloce(estrai_valori(testo)) + DISCLAIMER_VELOCE
+        else:
+            esito_analisi = analizza_in_area(esito.dati, "testo", estrai, area, cache)
+            esito.risultato = esito_analisi.risultato
+            # Verifica locale: su un hit della cache il testo non viene estratto
+            if esito.testo is not None and esito_analisi.completo:
+                mancanti = fuori_norma_non_citati(esito.risultato, estrai_valori(esito.testo))
+                if mancanti:
+                    esito.avvisi.append(
+                        "⚠️ Fuori range secondo la lettura automatica ma non citati "
+                        f"dall'analisi: {', '.join(mancanti)}"
+                    )
+    except Exception as e:
+        esito.errore = f"Errore: {e}"
+    return esito
+
+def analizza_uniti(esiti, cache, area=None):
+    # Modalita' unica: estrazione in parallelo, poi una sola richiesta a Gemini
+    unito = EsitoFile(f"Analisi unica ({len(esiti)} file)", "multiplo")
+
+    def produci_contenuto():
+        with ThreadPoolExecutor(max_workers=min(MAX_FILE_PARALLELI, len(esiti))) as pool:
+            futures = [
+                pool.submit(contextvars.copy_context().run, prepara_contenuto, e.dati, e.tipo, CONFIG_IMMAGINE)
+                for e in esiti
+            ]
+            preparati = [f.result() for f in futures]
+        parti = []
+        for esito, preparato in zip(esiti, preparati):
+            unito.avvisi.extend(f"{esito.nome}: {a}" for a in preparato.avvisi)
+            esito.testo = preparato.testo
+            if preparato.contenuto is None:
+                unito.avvisi.append(f"⚠️ {esito.nome}: PDF vuoto o illeggibile, escluso dall'analisi.")
+            else:
+                parti.append((esito.nome, esito.tipo, preparato.contenuto))
+        return ContenutoPreparato(
+            unisci_contenuti(parti) if parti else None,
+            parziale=any(p.parziale for p in preparati),
+        )
+
+    # La chiave dipende dal contenuto e dall'ordine dei file
+    impronta = b"".join(hashlib.sha256(e.dati).digest() for e in esiti)
+    try:
+        unito.risultato = analizza_in_area(impronta, "multiplo", produci_contenuto, area, cache).risultato
+    except Exception as e:
+        unito.errore = f"Errore: {e}"
+    return unito
+
+def mostra_esito(esito, con_risultato=True):
+    if esito.miniatura is not None:
+        st.image(esito.miniatura, caption="Anteprima")
+    for nota in esito.note:
+        st.caption(nota)
+    for avviso in esito.avvisi:
+        st.warning(avviso)
+    if esito.errore:
+        st.error(esito.errore)
+    elif con_risultato and esito.risultato:
+        with misura("rendering"):
+            st.markdown(esito.risultato)
+
+def mostra_risultati(esiti):
+    if len(esiti) == 1:
+        mostra_intestazione_risultato()
+        mostra_esito(esiti[0])
+        return
+    st.markdown("---")
+    st.subheader("✅ Risultati Analisi")
+    for esito in esiti:
+        st.markdown(f"#### 📄 {esito.nome}")
+        mostra_esito(esito)
+
+def mostra_intestazione_risultato():
+    st.markdown("---")
+    st.subheader("✅ Risultato Analisi")
+
+def crea_area_streaming():
+    if not STREAMING_RISPOSTE:
+        return None
+    mostra_intestazione_risultato()
+    return st.empty()
+
+def mostra_pannello_debug(ultima_traccia):
+    with st.sidebar:
+        st.subheader("🔧 Debug")
+        if ultima_traccia is None:
+            st.caption("Nessuna analisi in questa sessione.")
+        else:
+            for fase, secondi in ultima_traccia.fasi:
+                st.text(f"{fase:<32}{secondi * 1000:>9.1f} ms")
+            for nome, valore in sorted(ultima_traccia.valori.items()):
+                st.text(f"{nome:<32}{valore:>12}")
+        with st.expander("Metriche (formato Prometheus)"):
+            st.code(registro.esporta_prometheus(), language="text")
+
+def salva_metriche():
+    try:
+        registro.scrivi_su_file()
+    except OSError:
+        # Le metriche non devono mai bloccare l'analisi
+        pass
 
 # ==================================================
 # MAIN LOOP
@@ -130,52 +267,162 @@ def estrai_testo_da_pdf(pdf_file_path):
 def main():
     if 'analysis_result' not in st.session_state: st.session_state.analysis_result = None
     if 'processed_file_id' not in st.session_state: st.session_state.processed_file_id = None
+    if 'ultima_traccia' not in st.session_state: st.session_state.ultima_traccia = None
+    if 'confronto_storico' not in st.session_state: st.session_state.confronto_storico = None
+
+    mostra_debug = st.sidebar.checkbox("🔧 Pannello debug (tempi e metriche)")
 
     st.title("⚕️ Analisi Sangue IA (Gemini 2.5)")
     st.markdown("Carica il tuo referto per una lettura assistita.")
     st.warning("**DISCLAIMER:** L'IA può commettere errori. Consulta sempre il medico.")
 
-    tipo_file = st.radio("Formato:", ("Immagine (JPG/PNG)", "Documento PDF"))
-    
-    file_caricato = None
-    if tipo_file == "Immagine (JPG/PNG)":
-        file_caricato = st.file_uploader("Carica foto", type=["jpg", "jpeg", "png"])
-    else:
-        file_caricato = st.file_uploader("Carica PDF", type=["pdf"])
-
-    if file_caricato is not None:
-        current_file_id = f"{file_caricato.name}_{file_caricato.size}"
-
-        if current_file_id != st.session_state.processed_file_id:
-            st.session_state.analysis_result = None
-            st.session_state.processed_file_id = current_file_id
-            
-            analisi_output = None
-            with st.spinner("⏳ Analisi Gemini 2.5 in corso..."):
-                if tipo_file == "Immagine (JPG/PNG)":
-                    try:
-                        image = Image.open(file_caricato)
-                        st.image(image, caption="Anteprima", use_container_width=True)
-                        analisi_output = analizza_referto_medico(image, "immagine")
-                    except Exception as e: st.error(f"Errore: {e}")
-
-                elif tipo_file == "Documento PDF":
-                    try:
-                        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-                            tmp.write(file_caricato.getvalue())
-                            path = tmp.name
-                        testo = estrai_testo_da_pdf(path)
-                        os.unlink(path)
-                        if testo: analisi_output = analizza_referto_medico(testo, "testo")
-                        else: analisi_output = "❌ PDF vuoto o illeggibile."
-                    except Exception as e: st.error(f"Errore: {e}")
-
-            st.session_state.analysis_result = analisi_output
-
-        if st.session_state.analysis_result:
-            st.markdown("---")
-            st.subheader("✅ Risultato Analisi")
-            st.markdown(st.session_state.analysis_result)
+    # Il formato di ogni file viene riconosciuto dal contenuto
+    file_caricati = st.file_uploader(
+        "Carica referti (PDF o foto JPG/PNG, anche più file)",
+        type=["pdf", "jpg", "jpeg", "png"],
+        accept_multiple_files=True,
+    )
+    modalita_veloce = st.checkbox(
+        "⚡ Modalità veloce per i PDF (solo valori fuori norma, senza IA)",
+        help="I valori vengono letti e confrontati con i range direttamente dal PDF, senza chiamare Gemini."
+    )
+    analisi_unica = False
+    if file_caricati and len(file_caricati) > 1 and not modalita_veloce:
+        analisi_unica = st.checkbox(
+            "🧩 Analisi unica (tutti i file in una sola richiesta)",
+            help="Per pagine fotografate separatamente o più PDF della stessa visita."
+        )
+
+    with st.expander("📈 Storico paziente (facoltativo)"):
+        paziente = st.text_input(
+            "ID paziente",
+            help="I valori dei PDF vengono salvati in locale e confrontati con i referti precedenti dello stesso paziente."
+        ).strip() or None
+        data_referto = st.date_input("Data del referto", value=datetime.date.today())
+
+    if file_caricati:
+        with traccia() as traccia_run:
+            elabora_file(file_caricati, modalita_veloce, analisi_unica, traccia_run, paziente, data_referto)
+
+    if mostra_debug:
+        mostra_pannello_debug(st.session_state.ultima_traccia)
+
+def elabora_singolo(esito, modalita_veloce, cache):
+    # Un solo file: risposta in streaming, anteprima e avvisi sopra il risultato
+    intestazione = st.container()
+    area = None
+    if esito.tipo == "immagine" or not modalita_veloce:
+        area = crea_area_streaming()
+    analizza_file_caricato(esito, modalita_veloce, cache, area)
+    if area is None:
+        return False  # verra' mostrato tutto insieme da mostra_risultati
+    with intestazione:
+        mostra_esito(esito, con_risultato=False)
+    return True
+
+def elabora_unita(esiti, validi, cache):
+    intestazione = st.container()
+    area = crea_area_streaming()
+    unito = analizza_uniti(validi, cache, area)
+    risultati = [unito] + [e for e in esiti if e.tipo is None]
+    if area is None:
+        return risultati, False
+    with intestazione:
+        for esito in risultati[1:]:
+            st.error(f"{esito.nome}: {esito.errore}")
+        mostra_esito(unito, con_risultato=False)
+    return risultati, True
+
+def elabora_in_parallelo(esiti, modalita_veloce, cache):
+    # I risultati compaiono man mano che ogni file termina
+    st.markdown("---")
+    st.subheader("✅ Risultati Analisi")
+    segnaposti = []
+    for esito in esiti:
+        st.markdown(f"#### 📄 {esito.nome}")
+        segnaposto = st.empty()
+        if esito.tipo is None:
+            with segnaposto.container():
+                mostra_esito(esito)
+        else:
+            segnaposto.info("⏳ In attesa...")
+        segnaposti.append(segnaposto)
+
+    validi = [i for i, esito in enumerate(esiti) if esito.tipo is not None]
+    if not validi:
+        return
+    with ThreadPoolExecutor(max_workers=min(MAX_FILE_PARALLELI, len(validi))) as pool:
+        # Ogni task riceve una copia del contesto: la traccia della sessione resta visibile
+        futures = {
+            pool.submit(contextvars.copy_context().run, analizza_file_caricato, esiti[i], modalita_veloce, cache): i
+            for i in validi
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            with segnaposti[i].container():
+                mostra_esito(esiti[i])
+
+def elabora_file(file_caricati, modalita_veloce, analisi_unica, traccia_run, paziente=None, data_referto=None):
+    with misura("lettura_upload"):
+        caricati = [(f.name, f.getvalue()) for f in file_caricati]
+    # Id basato sul contenuto (e sull'ordine) dei file caricati
+    impronta = b"".join(hashlib.sha256(dati).digest() for _, dati in caricati)
+    current_file_id = calcola_chiave(
+        impronta, f"{modalita_veloce}|{analisi_unica}|{paziente}|{data_referto}", MODEL_NAME, PROMPT_VERSION
+    )
+
+    mostrati = False
+    if current_file_id != st.session_state.processed_file_id:
+        st.session_state.analysis_result = None
+        st.session_state.confronto_storico = None
+        st.session_state.processed_file_id = current_file_id
+
+        esiti = []
+        for nome, dati in caricati:
+            tipo = rileva_tipo(dati)
+            errore = None if tipo else "❌ Formato non riconosciuto: carica un PDF, JPG o PNG."
+            esiti.append(EsitoFile(nome, tipo, dati, errore=errore))
+        validi = [e for e in esiti if e.tipo is not None]
+        cache = get_cache_risultati()
+
+        with st.spinner("⏳ Analisi Gemini 2.5 in corso..."):
+            if analisi_unica and len(validi) > 1:
+                risultati, mostrati = elabora_unita(esiti, validi, cache)
+            elif len(esiti) == 1:
+                risultati = esiti
+                mostrati = elabora_singolo(esiti[0], modalita_veloce, cache)
+            else:
+                risultati = esiti
+                elabora_in_parallelo(esiti, modalita_veloce, cache)
+                mostrati = True
+
+        confronti = []
+        if paziente:
+            for esito in validi:
+                if esito.tipo != "testo":
+                    continue
+                try:
+                    # Con un hit della cache il PDF non e' stato estratto: serve solo il testo, non Gemini
+                    testo = esito.testo if esito.testo is not None else estrai_testo_referto(esito.dati, rasterizza=False).testo
+                    tabella = aggiorna_storico(paziente, data_referto, esito.dati, testo) if testo else None
+                except Exception as e:
+                    st.error(f"Errore storico ({esito.nome}): {e}")
+                    continue
+                if tabella:
+                    confronti.append((esito.nome, tabella))
+
+        for esito in esiti:
+            esito.dati = b""  # i byte dei file non servono piu' nella sessione
+        st.session_state.analysis_result = risultati
+        st.session_state.confronto_storico = confronti or None
+        st.session_state.ultima_traccia = traccia_run
+        salva_metriche()
+
+    # Se i risultati sono appena stati mostrati non vanno ripetuti
+    if st.session_state.analysis_result and not mostrati:
+        mostra_risultati(st.session_state.analysis_result)
+    if st.session_state.confronto_storico:
+        mostra_confronto(st.session_state.confronto_storico)
 
 if __name__ == "__main__":
     main()
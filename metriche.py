@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# METRICHE DELLA PIPELINE
+# ==================================================
+# Contatori e istogrammi in stile Prometheus, senza dipendenze esterne.
+# Ogni fase (upload, estrazione, compattazione, chiamata a Gemini,
+# rendering...) viene cronometrata con `misura("fase")`. I valori sono
+# esportabili in formato testo Prometheus e salvati su file; la traccia
+# dell'ultima richiesta alimenta il pannello di debug dell'app.
+
+import bisect
+import contextlib
+import contextvars
+import os
+import tempfile
+import threading
+import time
+
+METRICHE_PATH = os.getenv("REFERTI_METRICHE_PATH", os.path.join(".cache", "metriche.prom"))
+
+BUCKET_SECONDI = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BUCKET_BYTE = (1e3, 1e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7)
+
+
+def _chiave_etichette(etichette):
+    return tuple(sorted((k, str(v)) for k, v in etichette.items()))
+
+
+def _formatta_etichette(chiave, extra=()):
+    coppie = list(chiave) + list(extra)
+    if not coppie:
+        return ""
+    valori = ",".join(f'{k}="{str(v)}"' for k, v in coppie)
+    return "{" + valori + "}"
+
+
+class Contatore:
+    tipo = "counter"
+
+    def __init__(self, nome, descrizione):
+        self.nome = nome
+        self.descrizione = descrizione
+        self._valori = {}
+        self._lock = threading.Lock()
+
+    def incrementa(self, valore=1, **etichette):
+        chiave = _chiave_etichette(etichette)
+        with self._lock:
+            self._valori[chiave] = self._valori.get(chiave, 0) + valore
+
+    def valore(self, **etichette):
+        return self._valori.get(_chiave_etichette(etichette), 0)
+
+    def righe(self):
+        with self._lock:
+            return [f"{self.nome}{_formatta_etichette(k)} {v:g}" for k, v in sorted(self._valori.items())]
+
+
+class Istogramma:
+    tipo = "histogram"
+
+    def __init__(self, nome, descrizione, bucket=BUCKET_SECONDI):
+        self.nome = nome
+        self.descrizione = descrizione
+        self.bucket = tuple(sorted(bucket))
+        self._serie = {}
+        self._lock = threading.Lock()
+
+    def osserva(self, valore, **etichette):
+        chiave = _chiave_etichette(etichette)
+        with self._lock:
+            serie = self._serie.get(chiave)
+            if serie is None:
+                serie = self._serie[chiave] = [[0] * len(self.bucket), 0, 0.0]
+            indice = bisect.bisect_left(self.bucket, valore)
+            if indice < len(self.bucket):
+                serie[0][indice] += 1
+            serie[1] += 1
+            serie[2] += valore
+
+    def conteggio(self, **etichette):
+        serie = self._serie.get(_chiave_etichette(etichette))
+        return serie[1] if serie else 0
+
+    def righe(self):
+        righe = []
+        with self._lock:
+            for chiave, (conteggi, totale, somma) in sorted(self._serie.items()):
+                cumulato = 0
+                for limite, n in zip(self.bucket, conteggi):
+                    cumulato += n
+                    righe.append(f"{self.nome}_bucket{_formatta_etichette(chiave, [('le', f'{limite:g}')])} {cumulato}")
+                righe.append(f"{self.nome}_bucket{_formatta_etichette(chiave, [('le', '+Inf')])} {totale}")
+                righe.append(f"{self.nome}_sum{_formatta_etichette(chiave)} {somma:g}")
+                righe.append(f"{self.nome}_count{_formatta_etichette(chiave)} {totale}")
+        return righe
+
+
+class Registro:
+    def __init__(self):
+        self._metriche = {}
+        self._lock = threading.Lock()
+
+    def _registra(self, classe, nome, descrizione, **opzioni):
+        with self._lock:
+            metrica = self._metriche.get(nome)
+            if metrica is None:
+                metrica = self._metriche[nome] = classe(nome, descrizione, **opzioni)
+            return metrica
+
+    def contatore(self, nome, descrizione=""):
+        return self._registra(Contatore, nome, descrizione)
+
+    def istogramma(self, nome, descrizione="", bucket=BUCKET_SECONDI):
+        return self._registra(Istogramma, nome, descrizione, bucket=bucket)
+
+    def esporta_prometheus(self):
+        righe = []
+        for nome, metrica in sorted(self._metriche.items()):
+            righe.append(f"# HELP {nome} {metrica.descrizione}")
+            righe.append(f"# TYPE {nome} {metrica.tipo}")
+            righe.extend(metrica.righe())
+        return "\n".join(righe) + "\n"
+
+    def scrivi_su_file(self, path=METRICHE_PATH):
+        cartella = os.path.dirname(path) or "."
+        os.makedirs(cartella, exist_ok=True)
+        # Scrittura atomica: chi legge il file non vede mai un export a meta'
+        fd, temporaneo = tempfile.mkstemp(dir=cartella, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write(self.esporta_prometheus())
+        os.replace(temporaneo, path)
+
+
+registro = Registro()
+
+DURATA_FASI = registro.istogramma("referto_fase_durata_secondi", "Durata di ogni fase della pipeline")
+TENTATIVI_GEMINI = registro.contatore("gemini_tentativi_totali", "Chiamate a Gemini per esito")
+TOKEN_GEMINI = registro.contatore("gemini_token_totali", "Token riportati da usage_metadata")
+DIMENSIONI = registro.istogramma("referto_dimensione_byte", "Dimensione di input e output", bucket=BUCKET_BYTE)
+CACHE_RICHIESTE = registro.contatore("cache_risultati_richieste_totali", "Accessi alla cache dei risultati")
+
+
+# ==================================================
+# TRACCIA DELLA RICHIESTA CORRENTE
+# ==================================================
+class Traccia:
+    def __init__(self):
+        self.fasi = []
+        self.valori = {}
+
+    def aggiungi(self, fase, secondi):
+        self.fasi.append((fase, secondi))
+
+    def imposta(self, nome, valore):
+        self.valori[nome] = valore
+
+    def incrementa(self, nome, valore=1):
+        self.valori[nome] = self.valori.get(nome, 0) + valore
+
+
+_traccia_corrente = contextvars.ContextVar("traccia_corrente", default=None)
+
+
+@contextlib.contextmanager
+def traccia():
+    t = Traccia()
+    token = _traccia_corrente.set(t)
+    try:
+        yield t
+    finally:
+        _traccia_corrente.reset(token)
+
+
+def traccia_corrente():
+    return _traccia_corrente.get()
+
+
+@contextlib.contextmanager
+def misura(fase):
+    inizio = time.perf_counter()
+    try:
+        yield
+    finally:
+        secondi = time.perf_counter() - inizio
+        DURATA_FASI.osserva(secondi, fase=fase)
+        t = _traccia_corrente.get()
+        if t is not None:
+            t.aggiungi(fase, secondi)
+
+
+def registra_dimensione(direzione, byte):
+    DIMENSIONI.osserva(byte, direzione=direzione)
+    t = _traccia_corrente.get()
+    if t is not None:
+        t.imposta(f"byte_{direzione}", byte)
+
+
+def registra_tentativo(esito):
+    TENTATIVI_GEMINI.incrementa(esito=esito)
+    t = _traccia_corrente.get()
+    if t is not None:
+        t.incrementa("tentativi_gemini")
+
+
+def registra_cache(esito):
+    CACHE_RICHIESTE.incrementa(esito=esito)
+    t = _traccia_corrente.get()
+    if t is not None:
+        t.imposta("cache", esito)
+
+
+def registra_uso_token(risposta):
+    uso = getattr(risposta, "usage_metadata", None)
+    if not uso:
+        return
+    t = _traccia_corrente.get()
+    for tipo, campo in (("input", "prompt_token_count"), ("output", "candidates_token_count")):
+        valore = getattr(uso, campo, 0) or 0
+        if valore:
+            TOKEN_GEMINI.incrementa(valore, tipo=tipo)
+            if t is not None:
+                t.incrementa(f"token_{tipo}", valore)
@@ -0,0 +1,151 @@
+import asyncio
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from crewai import Crew, Process, Task
+from agents import blood_test_analyst, article_researcher, health_advisor
+from tasks import analyze_blood_test_task, blood_test_inputs, find_articles_task, provide_recommendations_task
+
+# Default orchestration settings
+MAX_CONCURRENT_RESEARCH = 4
+RESEARCH_TIMEOUT = 180  # seconds per research branch
+ANALYSIS_TIMEOUT = 300
+RECOMMENDATIONS_TIMEOUT = 300
+MAX_CONCERNS = 5
+
+CONCERN_KEYWORDS = re.compile(
+    r"\b(high|low|elevated|increased|decreased|reduced|abnormal|deficien\w*|"
+    r"alto|alta|alti|basso|bassa|bassi|elevat\w*|ridott\w*|fuori\s+norma)\b",
+    re.IGNORECASE,
+)
+BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+
+
+def extract_concerns(analysis, limit=MAX_CONCERNS):
+    # Pick bullet/numbered lines of the analyst output that describe an abnormal value
+    concerns = []
+    for line in analysis.splitlines():
+        if not BULLET.match(line) or not CONCERN_KEYWORDS.search(line):
+            continue
+        concern = BULLET.sub("", line).replace("**", "").strip(" :.")
+        if concern and concern.lower() not in (c.lower() for c in concerns):
+            concerns.append(concern)
+        if len(concerns) >= limit:
+            break
+    return concerns
+
+
+def clone_task(task, description, agent):
+    # Same wording/expected output as the template task, specialised description
+    return Task(
+        description=description,
+        expected_output=task.expected_output,
+        agent=agent,
+    )
+
+
+def build_research_task(concern, analysis):
+    description = (
+        f"{find_articles_task.description}\n"
+        f"Focus ONLY on this health concern: \"{concern}\".\n"
+        f"Blood test analysis for reference:\n{analysis}"
+    )
+    # Each branch gets its own copy of the researcher so concurrent runs don't share state
+    return clone_task(find_articles_task, description, article_researcher.copy())
+
+
+def build_recommendations_task(analysis, research):
+    findings = "\n\n".join(f"### {concern}\n{result}" for concern, result in research.items())
+    description = (
+        f"{provide_recommendations_task.description}\n"
+        f"Blood test analysis:\n{analysis}\n\n"
+        f"Research findings per concern:\n{findings or 'No research available.'}"
+    )
+    return clone_task(provide_recommendations_task, description, health_advisor)
+
+
+def run_task(task, inputs=None):
+    crew = Crew(agents=[task.agent], tasks=[task], process=Process.sequential)
+    return str(crew.kickoff(inputs=inputs or {}))
+
+
+async def run_branch(executor, task, timeout, inputs=None, start_deadline=None):
+    # The executor's worker count is the concurrency limit. A timed-out thread
+    # cannot be killed, so it keeps its worker (and slot) until it finishes;
+    # only its result is no longer awaited.
+    loop = asyncio.get_running_loop()
+    started = asyncio.Event()
+
+    def call():
+        loop.call_soon_threadsafe(started.set)
+        return run_task(task, inputs)
+
+    future = asyncio.wrap_future(executor.submit(call))
+    # Waiting for a free worker doesn't eat into the branch timeout, but is
+    # bounded by the phase deadline
+    try:
+        wait = None if start_deadline is None else max(start_deadline - loop.time(), 0)
+        await asyncio.wait_for(started.wait(), wait)
+    except asyncio.TimeoutError:
+        future.cancel()
+        raise
+    return await asyncio.wait_for(future, timeout)
+
+
+async def run_parallel_crew(report_text, max_concurrency=MAX_CONCURRENT_RESEARCH,
+                            research_timeout=RESEARCH_TIMEOUT, max_concerns=MAX_CONCERNS,
+                            analysis_timeout=ANALYSIS_TIMEOUT,
+                            recommendations_timeout=RECOMMENDATIONS_TIMEOUT):
+    # Dedicated pools, shut down without waiting: a hung thread doesn't keep
+    # the caller (or asyncio.run's default executor shutdown) waiting
+    sequential = ThreadPoolExecutor(max_workers=1, thread_name_prefix="crew")
+    research_pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="research")
+    try:
+        # 1. Blood test analysis (everything else depends on it)
+        analysis_task = clone_task(
+            analyze_blood_test_task, analyze_blood_test_task.description, blood_test_analyst
+        )
+        analysis = await run_branch(
+            sequential, analysis_task, analysis_timeout, blood_test_inputs(report_text)
+        )
+
+        # 2. Fan out research: one researcher run per concern, bounded concurrency.
+        # Queued branches may wait as long as every round using its full timeout
+        concerns = extract_concerns(analysis, max_concerns) or ["overall blood test findings"]
+        rounds = -(-len(concerns) // max_concurrency)
+        start_deadline = asyncio.get_running_loop().time() + research_timeout * rounds
+        branches = [
+            run_branch(research_pool, build_research_task(concern, analysis), research_timeout,
+                       start_deadline=start_deadline)
+            for concern in concerns
+        ]
+        outcomes = await asyncio.gather(*branches, return_exceptions=True)
+
+        research, failures = {}, {}
+        for concern, outcome in zip(concerns, outcomes):
+            if isinstance(outcome, asyncio.TimeoutError):
+                failures[concern] = f"timed out after {research_timeout}s"
+            elif isinstance(outcome, Exception):
+                failures[concern] = f"{type(outcome).__name__}: {outcome}"
+            else:
+                research[concern] = outcome
+
+        # 3. Recommendations start as soon as every branch has finished or timed out
+        recommendations = await run_branch(
+            sequential, build_recommendations_task(analysis, research), recommendations_timeout
+        )
+    finally:
+        sequential.shutdown(wait=False, cancel_futures=True)
+        research_pool.shutdown(wait=False, cancel_futures=True)
+
+    return {
+        "analysis": analysis,
+        "concerns": concerns,
+        "research": research,
+        "failed_research": failures,
+        "recommendations": recommendations,
+    }
+
+
+def kickoff_parallel(report_text, **options):
+    return asyncio.run(run_parallel_crew(report_text, **options))
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# PARSER LOCALE DEI VALORI DI LABORATORIO
+# ==================================================
+# Trasforma il testo estratto dal PDF in record strutturati
+# (esame, valore, unita', range di riferimento, segnalazione "*").
+# Il confronto con i range e' vettorizzato con NumPy su tutti gli
+# analiti in un colpo solo. Ogni esame riceve il codice canonico
+# dell'indice dei sinonimi (analiti.py).
+
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from analiti import ESATTO, indice_analiti, normalizza_unita
+
+_NUM = r"\d+(?:[.,]\d+)*"
+
+_RE_MIGLIAIA = re.compile(r"^[1-9]\d{0,2}(?:\.\d{3})+$")
+
+_RE_RIGA = re.compile(
+    rf"""^\s*
+    (?P<flag_pre>\*)?\s*
+    (?P<nome>[^\W\d_][\w\s().,/%'+-]*?)\s+
+    (?P<flag_val>\*)?\s*
+    (?P<valore>{_NUM})\s*
+    (?P<flag_post>\*|[HL](?=\s))?\s*
+    (?P<unita>(?:10\^\d+|x10\^\d+)?[^\s\d*<>≤≥]\S*)?\s+
+    (?:
+        (?P<min>{_NUM})\s*[-–÷]\s*(?P<max>{_NUM})
+      | (?P<op>[<>]=?|≤|≥)\s*(?P<limite>{_NUM})
+    )
+    \s*(?P<flag_fine>\*|[HL])?\s*$""",
+    re.VERBOSE,
+)
+
+# Riga senza range di riferimento: accettata solo per analiti riconosciuti
+# con corrispondenza esatta e con la stessa unita' dell'indice, usando il
+# range predefinito
+_RE_RIGA_SENZA_RIF = re.compile(
+    rf"""^\s*
+    (?P<flag_pre>\*)?\s*
+    (?P<nome>[^\W\d_][\w\s().,/%'+-]*?)\s+
+    (?P<flag_val>\*)?\s*
+    (?P<valore>{_NUM})\s*
+    (?P<flag_post>\*|[HL](?=\s))?\s*
+    (?P<unita>(?:10\^\d+|x10\^\d+)?[^\s\d*<>≤≥]\S*)
+    \s*(?P<flag_fine>\*|[HL])?\s*$""",
+    re.VERBOSE,
+)
+
+
+@dataclass
+class ValoreLab:
+    nome: str
+    valore: float
+    unita: str
+    rif_min: Optional[float]
+    rif_max: Optional[float]
+    rif_testo: str
+    segnalato: bool
+    riga: str
+    fuori_range: bool = False
+    direzione: str = ""
+    codice: str = ""  # codice canonico, vuoto se l'esame non e' nell'indice
+
+
+def converti_numero(testo):
+    testo = testo.strip()
+    if "," in testo and "." in testo:
+        # 1.234,5 -> separatore delle migliaia italiano
+        testo = testo.replace(".", "").replace(",", ".")
+    elif _RE_MIGLIAIA.match(testo):
+        # 4.500 -> nei referti italiani il punto seguito da 3 cifre e' un separatore
+        testo = testo.replace(".", "")
+    else:
+        testo = testo.replace(",", ".")
+    return float(testo)
+
+
+def analizza_riga(riga):
+    m = _RE_RIGA.match(riga)
+    if not m:
+        return None
+    try:
+        valore = converti_numero(m.group("valore"))
+        if m.group("op"):
+            limite = converti_numero(m.group("limite"))
+            if m.group("op") in ("<", "<=", "≤"):
+                rif_min, rif_max = None, limite
+            else:
+                rif_min, rif_max = limite, None
+            rif_testo = f"{m.group('op')} {m.group('limite')}"
+        else:
+            rif_min = converti_numero(m.group("min"))
+            rif_max = converti_numero(m.group("max"))
+            rif_testo = f"{m.group('min')} - {m.group('max')}"
+    except ValueError:
+        return None
+
+    segnalato = any(m.group(g) for g in ("flag_pre", "flag_val", "flag_post", "flag_fine"))
+    return ValoreLab(
+        nome=" ".join(m.group("nome").split()),
+        valore=valore,
+        unita=m.group("unita") or "",
+        rif_min=rif_min,
+        rif_max=rif_max,
+        rif_testo=rif_testo,
+        segnalato=segnalato,
+        riga=riga.strip(),
+    )
+
+
+def analizza_riga_senza_riferimento(riga, indice=None):
+    m = _RE_RIGA_SENZA_RIF.match(riga)
+    if not m:
+        return None
+    trovato = (indice or indice_analiti()).cerca(m.group("nome"), unita=m.group("unita"))
+    # Prefissi e nomi approssimati bastano per il codice, non per un range
+    if trovato is None or trovato.metodo != ESATTO:
+        return None
+    analita = trovato.analita
+    if normalizza_unita(m.group("unita")) != normalizza_unita(analita.unita):
+        return None
+    try:
+        valore = converti_numero(m.group("valore"))
+    except ValueError:
+        return None
+    return ValoreLab(
+        nome=" ".join(m.group("nome").split()),
+        valore=valore,
+        unita=m.group("unita"),
+        rif_min=analita.rif_min,
+        rif_max=analita.rif_max,
+        rif_testo=f"{analita.rif_testo().replace('.', ',')} (rif. standard)",
+        segnalato=any(m.group(g) for g in ("flag_pre", "flag_val", "flag_post", "flag_fine")),
+        riga=riga.strip(),
+        codice=analita.codice,
+    )
+
+
+def assegna_codici(valori, indice=None):
+    indice = indice or indice_analiti()
+    for x in valori:
+        if not x.codice:
+            x.codice = indice.codice(x.nome, unita=x.unita) or ""
+    return valori
+
+
+def deduplica(valori):
+    # Lo stesso esame ripetuto (referti bilingui, pagine duplicate) con lo
+    # stesso valore compare una volta sola
+    visti = set()
+    unici = []
+    for x in valori:
+        chiave = (x.codice or x.nome.casefold(), x.valore, normalizza_unita(x.unita))
+        if chiave not in visti:
+            visti.add(chiave)
+            unici.append(x)
+    return unici
+
+
+def calcola_fuori_range(valori):
+    if not valori:
+        return valori
+    v = np.fromiter((x.valore for x in valori), dtype=float, count=len(valori))
+    lo = np.fromiter((x.rif_min if x.rif_min is not None else -np.inf for x in valori),
+                     dtype=float, count=len(valori))
+    hi = np.fromiter((x.rif_max if x.rif_max is not None else np.inf for x in valori),
+                     dtype=float, count=len(valori))
+    bassi = v < lo
+    alti = v > hi
+    for x, basso, alto in zip(valori, bassi.tolist(), alti.tolist()):
+        x.fuori_range = basso or alto
+        x.direzione = "basso" if basso else ("alto" if alto else "")
+    return valori
+
+
+def estrai_valori(testo) -> List[ValoreLab]:
+    indice = indice_analiti()
+    valori = []
+    for riga in testo.splitlines():
+        record = analizza_riga(riga) or analizza_riga_senza_riferimento(riga, indice)
+        if record is not None:
+            valori.append(record)
+    return calcola_fuori_range(assegna_codici(valori, indice))
+
+
+def _formatta_numero(x):
+    return f"{x:g}".replace(".", ",")
+
+
+def tabella_compatta(valori):
+    # Formato a colonne separate da "|": molti meno token del testo originale.
+    # Il codice canonico dice al modello quali righe sono lo stesso esame
+    righe = ["Esame|Codice|Valore|Unità|Riferimento|Fuori range"]
+    for x in deduplica(valori):
+        stato = x.direzione.upper() if x.fuori_range else ("*" if x.segnalato else "")
+        righe.append(f"{x.nome}|{x.codice}|{_formatta_numero(x.valore)}|{x.unita}|{x.rif_testo}|{stato}")
+    return "\n".join(righe)
+
+
+def prepara_input_compatto(testo, valori):
+    # Le righe degli analiti vengono sostituite dalla tabella; tutto il resto
+    # (note del laboratorio, intestazioni) resta disponibile al modello.
+    righe_analiti = {x.riga for x in valori}
+    residuo = "\n".join(
+        r for r in testo.splitlines() if r.strip() and r.strip() not in righe_analiti
+    )
+    return (
+        "--- VALORI ESTRATTI (colonna 'Fuori range' calcolata localmente) ---\n"
+        f"{tabella_compatta(valori)}\n\n"
+        f"--- ALTRO TESTO DEL REFERTO ---\n{residuo}"
+    )
+
+
+def report_veloce(valori):
+    valori = deduplica(valori)
+    fuori = [x for x in valori if x.fuori_range or x.segnalato]
+    righe = ["**📊 1. Valori Fuori Norma:**", ""]
+    if not fuori:
+        righe.append("Tutti i valori riconosciuti risultano nella norma.")
+    else:
+        righe.append("| Esame | Valore | Unità | Riferimento | |")
+        righe.append("|---|---|---|---|---|")
+        for x in fuori:
+            freccia = "⬆️" if x.direzione == "alto" else ("⬇️" if x.direzione == "basso" else "*")
+            righe.append(f"| {x.nome} | {_formatta_numero(x.valore)} | {x.unita} | {x.rif_testo} | {freccia} |")
+    righe.append("")
+    righe.append(f"*Valori riconosciuti automaticamente: {len(valori)} (senza IA).*")
+    return "\n".join(righe)
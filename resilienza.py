@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# RESILIENZA DELLE CHIAMATE A GEMINI
+# ==================================================
+# Backoff esponenziale con jitter, rispetto dei segnali di quota
+# (ResourceExhausted / 429), budget di tempo per richiesta e un circuit
+# breaker condiviso che fa fallire subito le richieste quando l'API e'
+# degradata, invece di accumulare tentativi destinati a fallire.
+
+import random
+import re
+import threading
+import time
+
+from google.api_core import exceptions
+
+QUOTA = "quota"
+TRANSITORIO = "transitorio"
+PERMANENTE = "permanente"
+
+_ERRORI_TRANSITORI = (
+    exceptions.ServiceUnavailable,
+    exceptions.InternalServerError,
+    exceptions.DeadlineExceeded,
+    exceptions.GatewayTimeout,
+    exceptions.BadGateway,
+    exceptions.Aborted,
+)
+
+_RE_RITARDO = (
+    re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE),
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE),
+)
+
+
+def classifica_errore(errore):
+    if isinstance(errore, (exceptions.ResourceExhausted, exceptions.TooManyRequests)):
+        return QUOTA
+    if isinstance(errore, _ERRORI_TRANSITORI):
+        return TRANSITORIO
+    codice = getattr(errore, "code", None)
+    if isinstance(codice, int) and codice >= 500:
+        return TRANSITORIO
+    if isinstance(errore, (ConnectionError, TimeoutError)):
+        return TRANSITORIO
+    return PERMANENTE
+
+
+def ritardo_suggerito(errore):
+    # Il server indica quanto attendere nel messaggio o nei dettagli RetryInfo
+    testo = f"{errore} {getattr(errore, 'details', '') or ''}"
+    for regex in _RE_RITARDO:
+        m = regex.search(testo)
+        if m:
+            return float(m.group(1))
+    return None
+
+
+def calcola_backoff(tentativo, base=0.5, massimo=8.0):
+    # "Full jitter": attese casuali evitano che i client ritentino tutti
+    # nello stesso istante amplificando i picchi di carico
+    return random.uniform(0, min(massimo, base * (2 ** tentativo)))
+
+
+class Scadenza:
+    def __init__(self, secondi):
+        self.fine = time.monotonic() + secondi
+
+    def rimanente(self):
+        return max(0.0, self.fine - time.monotonic())
+
+    def consente(self, attesa):
+        return self.rimanente() > attesa
+
+
+class CircuitBreaker:
+    CHIUSO = "chiuso"
+    APERTO = "aperto"
+    SEMI_APERTO = "semi-aperto"
+
+    def __init__(self, soglia_fallimenti=5, tempo_apertura=30.0):
+        self.soglia_fallimenti = soglia_fallimenti
+        self.tempo_apertura = tempo_apertura
+        self.stato = self.CHIUSO
+        self._fallimenti = 0
+        self._aperto_da = 0.0
+        self._prova_in_corso = False
+        self._lock = threading.Lock()
+
+    def consenti(self):
+        with self._lock:
+            if self.stato == self.CHIUSO:
+                return True
+            if self.stato == self.APERTO:
+                if time.monotonic() - self._aperto_da < self.tempo_apertura:
+                    return False
+                self.stato = self.SEMI_APERTO
+                self._prova_in_corso = False
+            # Semi-aperto: passa una sola richiesta di prova alla volta
+            if self._prova_in_corso:
+                return False
+            self._prova_in_corso = True
+            return True
+
+    def registra_successo(self):
+        with self._lock:
+            self.stato = self.CHIUSO
+            self._fallimenti = 0
+            self._prova_in_corso = False
+
+    def rilascia(self):
+        # Prova finita senza esito (es. generatore chiuso dal chiamante): si
+        # libera il posto senza cambiare stato, la prossima richiesta riprova
+        with self._lock:
+            self._prova_in_corso = False
+
+    def registra_fallimento(self):
+        with self._lock:
+            self._fallimenti += 1
+            if self.stato == self.SEMI_APERTO or self._fallimenti >= self.soglia_fallimenti:
+                self.stato = self.APERTO
+                self._aperto_da = time.monotonic()
+                self._prova_in_corso = False
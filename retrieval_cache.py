@@ -0,0 +1,266 @@
+import hashlib
+import os
+import re
+import time
+import urllib.request
+from html.parser import HTMLParser
+from typing import Optional, Type
+
+import chromadb
+import google.generativeai as genai
+import numpy as np
+from crewai_tools import BaseTool
+from pydantic import BaseModel, Field
+
+# Cache settings (the Chroma store shipped in db/ is reused)
+CHROMA_PATH = os.getenv("RETRIEVAL_CHROMA_PATH", "db")
+COLLECTION_NAME = "website_pages"
+PAGE_TTL = int(os.getenv("RETRIEVAL_PAGE_TTL", str(7 * 24 * 3600)))
+# Pages not refreshed for this long are dropped when the cache is opened.
+# Kept longer than the TTL so an expired but unchanged page keeps its embeddings
+PAGE_RETENTION = int(os.getenv("RETRIEVAL_PAGE_RETENTION", str(4 * PAGE_TTL)))
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+EMBED_BATCH_SIZE = 64
+FETCH_TIMEOUT = 15
+
+
+def sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _TextExtractor(HTMLParser):
+    SKIP = {"script", "style", "noscript", "nav", "footer", "header", "svg"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip and data.strip():
+            self.parts.append(data.strip())
+
+
+def html_to_text(html):
+    parser = _TextExtractor()
+    parser.feed(html)
+    return re.sub(r"\s+", " ", " ".join(parser.parts)).strip()
+
+
+def fetch_page(url):
+    request = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0 (blood-test-analysis)"})
+    with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+        charset = response.headers.get_content_charset() or "utf-8"
+        return html_to_text(response.read().decode(charset, errors="replace"))
+
+
+def chunk_text(text, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    chunks, start = [], 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            # Cut on a word boundary when possible
+            space = text.rfind(" ", start + size // 2, end)
+            end = space if space > start else end
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return [c for c in chunks if c]
+
+
+class GoogleEmbedder:
+    def __init__(self, model="models/embedding-001", task_type="retrieval_document", dimensions=768):
+        self.model = model
+        self.task_type = task_type
+        self.dimensions = dimensions
+
+    @property
+    def identity(self):
+        return f"google-{self.model.rsplit('/', 1)[-1]}-{self.dimensions}"
+
+    def __call__(self, texts, task_type=None):
+        # One API call per batch instead of one per chunk
+        result = genai.embed_content(model=self.model, content=list(texts), task_type=task_type or self.task_type)
+        return result["embedding"]
+
+
+class LocalEmbedder:
+    # Offline stand-in: hashed bag of words, deterministic and dependency free
+    def __init__(self, dimensions=256):
+        self.dimensions = dimensions
+
+    @property
+    def identity(self):
+        return f"local-{self.dimensions}"
+
+    def __call__(self, texts, task_type=None):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                index = int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.dimensions
+                vectors[row, index] += 1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).tolist()
+
+
+def default_embedder():
+    if os.getenv("RETRIEVAL_EMBEDDER", "google") == "local":
+        return LocalEmbedder()
+    return GoogleEmbedder()
+
+
+def collection_name(base, embedder):
+    # One collection per embedder: vectors of different models or sizes never
+    # share an index, and chunk embeddings are only reused within the same model
+    identity = getattr(embedder, "identity", type(embedder).__name__.lower())
+    return re.sub(r"[^a-zA-Z0-9._-]", "-", f"{base}-{identity}")[:63].strip("-._")
+
+
+class RetrievalCache:
+    def __init__(self, path=CHROMA_PATH, collection=COLLECTION_NAME, embedder=None,
+                 ttl=PAGE_TTL, fetcher=fetch_page, batch_size=EMBED_BATCH_SIZE, client=None,
+                 retention=PAGE_RETENTION):
+        self.client = client or chromadb.PersistentClient(path=path)
+        self.embedder = embedder or default_embedder()
+        self.collection = self.client.get_or_create_collection(
+            name=collection_name(collection, self.embedder), metadata={"hnsw:space": "cosine"}
+        )
+        self.ttl = ttl
+        self.retention = retention
+        self.fetcher = fetcher
+        self.batch_size = batch_size
+        self.stats = {"fresh": 0, "refetched_unchanged": 0, "embedded_pages": 0,
+                      "embedded_chunks": 0, "reused_chunks": 0, "compacted_chunks": 0}
+        self.compact()
+
+    def _page_metadata(self, url):
+        found = self.collection.get(where={"url": url}, include=["metadatas"], limit=1)
+        return found["metadatas"][0] if found["ids"] else None
+
+    def _reusable_embeddings(self, chunk_hashes):
+        # Identical chunks (mirrors, shared boilerplate) are never embedded twice
+        found = self.collection.get(
+            where={"chunk_hash": {"$in": list(set(chunk_hashes))}}, include=["metadatas", "embeddings"]
+        )
+        # Chroma returns arrays, new embeddings are lists: add() accepts only one kind
+        return {m["chunk_hash"]: np.asarray(e).tolist() for m, e in zip(found["metadatas"], found["embeddings"])}
+
+    def _embed(self, texts):
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(self.embedder(texts[start:start + self.batch_size]))
+        return embeddings
+
+    def ensure_page(self, url, now=None):
+        now = now or time.time()
+        meta = self._page_metadata(url)
+        if meta and now - meta["fetched_at"] < self.ttl:
+            self.stats["fresh"] += 1
+            return meta["content_hash"]
+
+        text = self.fetcher(url)
+        content_hash = sha256(text)
+        url_key = sha256(url)[:16]
+        if meta and meta["content_hash"] == content_hash:
+            # Page unchanged: only refresh the timestamp, keep the embeddings
+            existing = self.collection.get(where={"url": url}, include=["metadatas"])
+            for m in existing["metadatas"]:
+                m["fetched_at"] = now
+            self.collection.update(ids=existing["ids"], metadatas=existing["metadatas"])
+            self.stats["refetched_unchanged"] += 1
+            return content_hash
+
+        chunks = chunk_text(text)
+        chunk_hashes = [sha256(c) for c in chunks]
+        # Looked up before the old version is deleted: its unchanged chunks are reused
+        reusable = self._reusable_embeddings(chunk_hashes) if chunks else {}
+        if meta:
+            self.collection.delete(where={"url": url})
+        if not chunks:
+            return content_hash
+        # Unique chunks not already in the store, embedded in batches
+        missing = {}
+        for chunk, h in zip(chunks, chunk_hashes):
+            if h not in reusable and h not in missing:
+                missing[h] = chunk
+        embeddings = dict(reusable)
+        embeddings.update(zip(missing, self._embed(list(missing.values()))))
+
+        self.collection.add(
+            ids=[f"{url_key}:{content_hash[:16]}:{i}" for i in range(len(chunks))],
+            documents=chunks,
+            embeddings=[embeddings[h] for h in chunk_hashes],
+            metadatas=[{"url": url, "content_hash": content_hash, "chunk_hash": h,
+                        "chunk_index": i, "fetched_at": now}
+                       for i, h in enumerate(chunk_hashes)],
+        )
+        self.stats["embedded_pages"] += 1
+        self.stats["embedded_chunks"] += len(missing)
+        self.stats["reused_chunks"] += len(chunks) - len(missing)
+        return content_hash
+
+    def search(self, query, urls=None, k=5):
+        urls = [urls] if isinstance(urls, str) else (urls or [])
+        for url in urls:
+            self.ensure_page(url)
+        where = None
+        if len(urls) == 1:
+            where = {"url": urls[0]}
+        elif urls:
+            where = {"url": {"$in": urls}}
+        query_embedding = self.embedder([query], task_type="retrieval_query")[0]
+        result = self.collection.query(
+            query_embeddings=[query_embedding], n_results=k, where=where,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            {"url": m["url"], "text": d, "distance": dist}
+            for d, m, dist in zip(result["documents"][0], result["metadatas"][0], result["distances"][0])
+        ]
+
+    def compact(self, now=None, max_age=None):
+        # Drop pages not refreshed for max_age (default: the retention window);
+        # they will be re-fetched and re-embedded if needed again
+        now = now or time.time()
+        max_age = self.retention if max_age is None else max_age
+        expired = self.collection.get(where={"fetched_at": {"$lt": now - max_age}}, include=[])
+        if expired["ids"]:
+            self.collection.delete(ids=expired["ids"])
+        self.stats["compacted_chunks"] += len(expired["ids"])
+        return len(expired["ids"])
+
+
+class CachedWebsiteSearchSchema(BaseModel):
+    search_query: str = Field(..., description="Query to search the website content")
+    website: Optional[str] = Field(None, description="URL of the website to search")
+
+
+class CachedWebsiteSearchTool(BaseTool):
+    name: str = "Search in a specific website (cached)"
+    description: str = (
+        "Semantic search over the content of a website. Pages are fetched and "
+        "embedded once and reused across runs."
+    )
+    args_schema: Type[BaseModel] = CachedWebsiteSearchSchema
+    cache: RetrievalCache = None
+    top_k: int = 5
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _run(self, search_query, website=None):
+        results = self.cache.search(search_query, urls=website, k=self.top_k)
+        if not results:
+            return "No relevant content found."
+        return "\n\n".join(f"[{r['url']}]\n{r['text']}" for r in results)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# ROUTER DELLE PAGINE PDF (TESTO / IMMAGINE)
+# ==================================================
+# Ogni pagina segue la strada piu' economica: se ha un livello di testo
+# utilizzabile viene inviata come testo, altrimenti (pagina scansionata)
+# viene rasterizzata a DPI controllati e inviata come JPEG compresso.
+# La rasterizzazione usa pypdfium2 (opzionale) su un pool di processi;
+# senza pypdfium2 le pagine scansionate vengono segnalate ma non inviate.
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from PIL import Image
+
+from compattazione import stima_token
+from estrazione_pdf import RisultatoEstrazione, contesto_processi, estrai_pagine_pdf
+from immagini import ConfigImmagine, ricomprimi
+from metriche import misura
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # rasterizzazione non disponibile
+    pdfium = None
+
+RASTERIZZAZIONE_DISPONIBILE = pdfium is not None
+
+# Sotto questo numero di caratteri alfanumerici la pagina e' considerata scansionata
+MIN_CARATTERI_TESTO = 40
+DPI_RASTER = 150
+# Limite di pagine inviate come immagine per referto (costo di upload e token)
+MAX_PAGINE_RASTER = 20
+# Le pagine rasterizzate sono gia' a risoluzione controllata: budget piu' stretto delle foto
+CONFIG_PAGINA = ConfigImmagine(lato_lungo_max=1700, budget_byte=350 * 1024)
+
+
+@dataclass
+class PaginaImmagine:
+    indice: int
+    dati: bytes
+    dimensioni: tuple
+
+    def parte_gemini(self):
+        return {"mime_type": "image/jpeg", "data": self.dati}
+
+
+@dataclass
+class RisultatoRouter:
+    estrazione: RisultatoEstrazione
+    pagine_testo: List[int] = field(default_factory=list)
+    # Pagine senza testo utilizzabile, da inviare come immagine
+    pagine_scansionate: List[int] = field(default_factory=list)
+    pagine_immagine: List[PaginaImmagine] = field(default_factory=list)
+    # Pagine scansionate non inviate (pypdfium2 assente, limite superato, errore)
+    pagine_escluse: List[int] = field(default_factory=list)
+    testo: Optional[str] = None
+    dpi: int = DPI_RASTER
+
+    @property
+    def parziale(self):
+        # Qualche pagina scansionata non arriva al modello come immagine
+        return len(self.pagine_immagine) < len(self.pagine_scansionate)
+
+    @property
+    def byte_testo(self):
+        return len(self.testo.encode("utf-8")) if self.testo else 0
+
+    @property
+    def byte_immagini(self):
+        return sum(len(p.dati) for p in self.pagine_immagine)
+
+    def payload(self):
+        return {
+            "pagine_testo": len(self.pagine_testo),
+            "byte_testo": self.byte_testo,
+            "token_testo_stimati": stima_token(self.testo or ""),
+            "pagine_immagine": len(self.pagine_immagine),
+            "byte_immagini": self.byte_immagini,
+            "pagine_escluse": len(self.pagine_escluse),
+        }
+
+    def riepilogo(self):
+        testo = f"{len(self.pagine_testo)} come testo ({self.byte_testo / 1024:.1f} KB)"
+        if not self.pagine_immagine and not self.pagine_escluse:
+            return f"Pagine: {testo}"
+        immagini = (f"{len(self.pagine_immagine)} come immagine "
+                    f"({self.byte_immagini / 1024:.0f} KB, {self.dpi} dpi)")
+        escluse = f", {len(self.pagine_escluse)} escluse" if self.pagine_escluse else ""
+        return f"Pagine: {testo}, {immagini}{escluse}"
+
+
+def testo_utilizzabile(testo):
+    return testo is not None and len(re.sub(r"\W", "", testo)) >= MIN_CARATTERI_TESTO
+
+
+# Stato del processo worker: il documento viene aperto una sola volta per processo
+_documento_worker = None
+
+
+def _inizializza_worker(dati):
+    global _documento_worker
+    _documento_worker = pdfium.PdfDocument(dati)
+
+
+def _rasterizza(documento, indice, dpi, config):
+    pagina = documento[indice]
+    try:
+        immagine = pagina.render(scale=dpi / 72, grayscale=config.scala_di_grigi).to_pil()
+    finally:
+        pagina.close()
+    immagine = immagine.convert("L" if config.scala_di_grigi else "RGB")
+    if max(immagine.size) > config.lato_lungo_max:
+        immagine.thumbnail((config.lato_lungo_max, config.lato_lungo_max), Image.LANCZOS)
+    immagine, dati, _ = ricomprimi(immagine, config)
+    return PaginaImmagine(indice, dati, immagine.size)
+
+
+def _rasterizza_worker(indice, dpi, config):
+    return _rasterizza(_documento_worker, indice, dpi, config)
+
+
+def rasterizza_pagine(dati, indici, dpi=DPI_RASTER, config=CONFIG_PAGINA, max_worker=None):
+    # Restituisce (pagine rasterizzate, indici falliti); ordine delle pagine preservato
+    max_worker = max_worker or min(len(indici), os.cpu_count() or 1)
+    if len(indici) < 2 or max_worker < 2:
+        # pdfium non e' thread-safe: il caso sequenziale resta nel processo corrente
+        documento = pdfium.PdfDocument(dati)
+        pagine, fallite = [], []
+        try:
+            for indice in indici:
+                try:
+                    pagine.append(_rasterizza(documento, indice, dpi, config))
+                except Exception:
+                    fallite.append(indice)
+        finally:
+            documento.close()
+        return pagine, fallite
+
+    pagine, fallite = [], []
+    with ProcessPoolExecutor(max_workers=max_worker, mp_context=contesto_processi(),
+                             initializer=_inizializza_worker, initargs=(dati,)) as pool:
+        futures = [(i, pool.submit(_rasterizza_worker, i, dpi, config)) for i in indici]
+        for indice, future in futures:
+            try:
+                pagine.append(future.result())
+            except Exception:
+                fallite.append(indice)
+    return pagine, fallite
+
+
+def instrada_pagine(dati, max_pagine=None, timeout_pagina=None, rasterizza=True,
+                    dpi=DPI_RASTER, max_pagine_raster=MAX_PAGINE_RASTER):
+    estrazione = estrai_pagine_pdf(dati, max_pagine=max_pagine, timeout_pagina=timeout_pagina)
+    risultato = RisultatoRouter(estrazione, dpi=dpi)
+    if estrazione.errore is not None:
+        return risultato
+
+    scansionate = risultato.pagine_scansionate
+    for indice, testo in enumerate(estrazione.testi):
+        if testo_utilizzabile(testo):
+            risultato.pagine_testo.append(indice)
+        else:
+            scansionate.append(indice)
+
+    non_rasterizzate = scansionate
+    if scansionate and rasterizza and pdfium is not None:
+        da_rasterizzare = scansionate[:max_pagine_raster]
+        with misura("rasterizzazione_pdf"):
+            pagine, fallite = rasterizza_pagine(dati, da_rasterizzare, dpi)
+        risultato.pagine_immagine = pagine
+        non_rasterizzate = sorted(fallite + scansionate[max_pagine_raster:])
+
+    # Una pagina non rasterizzata conserva almeno il poco testo che ha
+    for indice in non_rasterizzate:
+        if estrazione.testi[indice]:
+            risultato.pagine_testo.append(indice)
+        else:
+            risultato.pagine_escluse.append(indice)
+    risultato.pagine_testo.sort()
+    testi = [estrazione.testi[i] for i in risultato.pagine_testo]
+    risultato.testo = "\n".join(testi) + "\n" if testi else None
+    return risultato
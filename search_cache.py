@@ -0,0 +1,169 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Any, Optional, Type
+
+from crewai_tools import BaseTool
+from pydantic import BaseModel, Field
+
+# Cache settings
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", os.path.join(".cache", "search.sqlite3"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", str(3 * 24 * 3600)))
+
+
+def normalize_query(query):
+    # "High  LDL Cholesterol?" and "high ldl cholesterol" share the same key
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = re.sub(r"[\"'`?!.,;:]+", " ", query)
+    return " ".join(query.split())
+
+
+def make_key(query, **params):
+    extra = json.dumps({k: v for k, v in sorted(params.items()) if v is not None}, sort_keys=True)
+    return f"{normalize_query(query)}|{extra}"
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SearchCache:
+    def __init__(self, path=SEARCH_CACHE_PATH, ttl=SEARCH_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS searches ("
+                " key TEXT PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL)"
+            )
+        self.purge_expired()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT result, created FROM searches WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl and time.time() - row[1] > self.ttl:
+                # Expired rows are removed, not just ignored, so the store stays bounded
+                conn.execute("DELETE FROM searches WHERE key = ? AND created = ?", (key, row[1]))
+                row = None
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, result):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO searches (key, result, created) VALUES (?, ?, ?)",
+                (key, json.dumps(result), time.time()),
+            )
+
+    def purge_expired(self):
+        if not self.ttl:
+            return 0
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM searches WHERE created < ?", (time.time() - self.ttl,)
+            ).rowcount
+
+    def get_or_fetch(self, key, fetch):
+        cached = self.get(key)
+        if cached is not None:
+            with self._lock:
+                self.stats["hits"] += 1
+            return cached
+
+        # Only one request per key is in flight; concurrent callers wait for it
+        with self._lock:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                # A leader may have stored the result and left since the lookup above
+                cached = self.get(key)
+                if cached is not None:
+                    self.stats["hits"] += 1
+                    return cached
+                flight = self._in_flight[key] = _InFlight()
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fetch()
+            self.set(key, flight.result)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            with self._lock:
+                self.stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            flight.done.set()
+
+    def hit_rate(self):
+        total = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return (self.stats["hits"] + self.stats["coalesced"]) / total if total else 0.0
+
+
+class FakeSearchBackend:
+    # Local stand-in for SerperDevTool in tests and offline runs
+    def __init__(self, latency=0.0, results=None):
+        self.latency = latency
+        self.results = results or {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def run(self, search_query, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return self.results.get(
+            normalize_query(search_query),
+            f"Search results for '{search_query}':\n- Title: Example article\n  Link: https://example.org/article",
+        )
+
+
+class CachedSearchSchema(BaseModel):
+    search_query: str = Field(..., description="Mandatory search query you want to use to search the internet")
+
+
+class CachedSearchTool(BaseTool):
+    name: str = "Search the internet (cached)"
+    description: str = (
+        "Search the internet for a query. Repeated queries are served from a local cache."
+    )
+    args_schema: Type[BaseModel] = CachedSearchSchema
+    backend: Any = None
+    cache: Optional[SearchCache] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _run(self, search_query, **kwargs):
+        if self.cache is None:
+            self.cache = SearchCache()
+        key = make_key(search_query, **kwargs)
+        return self.cache.get_or_fetch(key, lambda: self.backend.run(search_query=search_query, **kwargs))
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+# ==================================================
+# STORICO LONGITUDINALE DEI VALORI
+# ==================================================
+# I valori estratti da ogni referto vengono salvati in SQLite, indicizzati
+# per paziente, analita e data. Un nuovo referto si confronta con i
+# precedenti (delta, tendenza, valori appena usciti dalla norma) con una
+# sola query e calcoli vettorizzati in NumPy, senza rimandare i vecchi
+# referti a Gemini. Gli analiti sono indicizzati per codice canonico e
+# unita' di misura, cosi' "Hb" di un laboratorio si confronta con
+# "Emoglobina" di un altro, ma una conta non si confonde con una %.
+
+import datetime
+import os
+import sqlite3
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+
+from analiti import indice_analiti, normalizza_unita
+
+STORICO_PATH = os.getenv("REFERTI_STORICO_PATH", os.path.join(".cache", "storico.sqlite3"))
+
+# Sotto questa variazione (relativa al valore medio, su 30 giorni) il valore e' stabile
+SOGLIA_STABILE = 0.02
+
+# Versione delle chiavi degli analiti (PRAGMA user_version):
+# 1 = codici canonici, 2 = codice canonico + unita' normalizzata
+VERSIONE_CHIAVI = 2
+
+
+def chiave_analita(nome, unita):
+    # Codice canonico se l'esame e' nell'indice ("Hb", "HGB" -> "HGB"),
+    # altrimenti il nome normalizzato ("Colesterolo  LDL" = "colesterolo ldl"),
+    # seguito dall'unita': valori in unita' diverse non si confrontano
+    codice = indice_analiti().codice(nome, unita=unita) or " ".join(nome.casefold().split())
+    return f"{codice}|{normalizza_unita(unita)}"
+
+
+def _giorno(data):
+    if isinstance(data, str):
+        data = datetime.date.fromisoformat(data)
+    return data.toordinal()
+
+
+@dataclass
+class Confronto:
+    nome: str
+    valore: float
+    unita: str
+    fuori_range: bool
+    precedente: Optional[float] = None
+    data_precedente: Optional[str] = None
+    delta: Optional[float] = None
+    delta_pct: Optional[float] = None
+    # Variazione stimata ogni 30 giorni (retta ai minimi quadrati su tutte le misure)
+    tendenza_30g: Optional[float] = None
+    misure: int = 1
+    nuovo_fuori_range: bool = False
+    rientrato: bool = False
+
+
+class StoricoValori:
+    def __init__(self, path=STORICO_PATH):
+        self.path = path
+        cartella = os.path.dirname(path)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        with self._connetti() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS valori ("
+                " paziente TEXT NOT NULL,"
+                " analita TEXT NOT NULL,"
+                " giorno INTEGER NOT NULL,"
+                " id_referto TEXT NOT NULL,"
+                " nome TEXT NOT NULL,"
+                " valore REAL NOT NULL,"
+                " unita TEXT NOT NULL,"
+                " rif_min REAL,"
+                " rif_max REAL,"
+                " fuori_range INTEGER NOT NULL,"
+                " PRIMARY KEY (paziente, id_referto, analita))"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_valori_paziente_analita"
+                " ON valori (paziente, analita, giorno)"
+            )
+            self._aggiorna_chiavi(conn)
+
+    def _connetti(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _aggiorna_chiavi(self, conn):
+        # Le righe salvate con le chiavi precedenti vengono ricalcolate una volta.
+        # Se due righe dello stesso referto finirebbero sulla stessa chiave, la
+        # seconda conserva la chiave vecchia: la migrazione non cancella nulla
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= VERSIONE_CHIAVI:
+            return
+        nomi = conn.execute("SELECT DISTINCT nome, unita FROM valori").fetchall()
+        conn.executemany(
+            "UPDATE OR IGNORE valori SET analita = ? WHERE nome = ? AND unita = ?",
+            [(chiave_analita(nome, unita), nome, unita) for nome, unita in nomi],
+        )
+        conn.execute(f"PRAGMA user_version = {VERSIONE_CHIAVI}")
+
+    def salva_referto(self, paziente, id_referto, data, valori):
+        # Ricaricare lo stesso referto sovrascrive i valori invece di duplicarli;
+        # lo stesso esame ripetuto nel referto vale una volta (la prima, come in confronta)
+        giorno = _giorno(data)
+        with self._connetti() as conn:
+            conn.execute(
+                "DELETE FROM valori WHERE paziente = ? AND id_referto = ?", (paziente, id_referto)
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO valori"
+                " (paziente, analita, giorno, id_referto, nome, valore, unita, rif_min, rif_max, fuori_range)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (paziente, chiave_analita(x.nome, x.unita), giorno, id_referto, x.nome, x.valore,
+                     x.unita, x.rif_min, x.rif_max, int(x.fuori_range))
+                    for x in valori
+                ],
+            )
+
+    def _precedenti(self, paziente, analiti, giorno, id_referto):
+        segnaposti = ",".join("?" * len(analiti))
+        with self._connetti() as conn:
+            return conn.execute(
+                "SELECT analita, giorno, valore, unita, fuori_range FROM valori"
+                f" WHERE paziente = ? AND analita IN ({segnaposti})"
+                " AND giorno <= ? AND id_referto != ?"
+                " ORDER BY analita, giorno",
+                (paziente, *analiti, giorno, id_referto),
+            ).fetchall()
+
+    def confronta(self, paziente, id_referto, data, valori) -> List[Confronto]:
+        # Confronto del referto corrente con tutti i precedenti del paziente
+        # (il referto stesso e quelli successivi alla sua data sono esclusi)
+        if not valori:
+            return []
+        giorno = _giorno(data)
+        correnti = {}
+        for x in valori:
+            correnti.setdefault(chiave_analita(x.nome, x.unita), x)
+        chiavi = list(correnti)
+        confronti = [Confronto(x.nome, x.valore, x.unita, x.fuori_range) for x in correnti.values()]
+
+        # La chiave contiene l'unita': si confrontano solo misure omogenee
+        righe = self._precedenti(paziente, chiavi, giorno, id_referto)
+        if not righe:
+            return confronti
+
+        indice = {k: i for i, k in enumerate(chiavi)}
+        gruppo = np.array([indice[r[0]] for r in righe] + list(range(len(chiavi))))
+        giorni = np.array([r[1] for r in righe] + [giorno] * len(chiavi), dtype=float)
+        misure = np.array([r[2] for r in righe] + [x.valore for x in correnti.values()])
+        fuori = np.array([bool(r[4]) for r in righe] + [x.fuori_range for x in correnti.values()])
+        storiche = np.arange(len(gruppo)) < len(righe)
+
+        # Ultima misura precedente per analita: le righe arrivano gia' ordinate per giorno
+        ultimo = np.full(len(chiavi), -1)
+        np.maximum.at(ultimo, gruppo[storiche], np.nonzero(storiche)[0])
+        ha_precedente = ultimo >= 0
+        corrente = misure[len(righe):]
+        precedente = np.where(ha_precedente, misure[np.maximum(ultimo, 0)], np.nan)
+        delta = corrente - precedente
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta_pct = np.where(precedente != 0, delta / np.abs(precedente) * 100, np.nan)
+
+        # Tendenza: pendenza ai minimi quadrati per gruppo con somme vettorizzate
+        n = np.bincount(gruppo, minlength=len(chiavi)).astype(float)
+        x = giorni - giorno  # centrato sul giorno corrente per stabilita' numerica
+        sx = np.bincount(gruppo, x, len(chiavi))
+        sy = np.bincount(gruppo, misure, len(chiavi))
+        sxx = np.bincount(gruppo, x * x, len(chiavi))
+        sxy = np.bincount(gruppo, x * misure, len(chiavi))
+        denominatore = n * sxx - sx * sx
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pendenza = np.where(denominatore > 0, (n * sxy - sx * sy) / denominatore, np.nan)
+
+        precedente_fuori = np.where(ha_precedente, fuori[np.maximum(ultimo, 0)], False)
+        corrente_fuori = fuori[len(righe):]
+        nuovi = corrente_fuori & ~precedente_fuori & ha_precedente
+        rientrati = ~corrente_fuori & precedente_fuori
+
+        for i, c in enumerate(confronti):
+            if not ha_precedente[i]:
+                continue
+            c.precedente = float(precedente[i])
+            c.data_precedente = datetime.date.fromordinal(int(giorni[ultimo[i]])).isoformat()
+            c.delta = float(delta[i])
+            c.delta_pct = None if np.isnan(delta_pct[i]) else float(delta_pct[i])
+            c.tendenza_30g = None if np.isnan(pendenza[i]) else float(pendenza[i] * 30)
+            c.misure = int(n[i])
+            c.nuovo_fuori_range = bool(nuovi[i])
+            c.rientrato = bool(rientrati[i])
+        return confronti
+
+
+def _numero(x):
+    return f"{x:+.4g}".replace(".", ",")
+
+
+def _freccia(c):
+    if c.tendenza_30g is None:
+        return ""
+    media = abs(c.valore) or 1.0
+    if abs(c.tendenza_30g) < SOGLIA_STABILE * media:
+        return "➡️"
+    return "⬆️" if c.tendenza_30g > 0 else "⬇️"
+
+
+def tabella_confronto(confronti):
+    confrontabili = [c for c in confronti if c.precedente is not None]
+    if not confrontabili:
+        return "Nessun referto precedente confrontabile per questo paziente."
+    # Prima i valori appena usciti dalla norma, poi le variazioni piu' grandi
+    confrontabili.sort(key=lambda c: (not c.nuovo_fuori_range, -abs(c.delta_pct or 0)))
+    righe = [
+        "| Esame | Attuale | Precedente | Δ | Δ % | Tendenza | Misure | |",
+        "|---|---|---|---|---|---|---|---|",
+    ]
+    for c in confrontabili:
+        nota = "🆕 fuori norma" if c.nuovo_fuori_range else ("✅ rientrato" if c.rientrato else "")
+        pct = f"{c.delta_pct:+.1f}%".replace(".", ",") if c.delta_pct is not None else ""
+        righe.append(
+            f"| {c.nome} | {c.valore:g} {c.unita} | {c.precedente:g} ({c.data_precedente}) "
+            f"| {_numero(c.delta)} | {pct} | {_freccia(c)} | {c.misure} | {nota} |"
+        )
+    return "\n".join(righe)
@@ -1,25 +1,12 @@
 from crewai import Task
 from agents import blood_test_analyst, article_researcher, health_advisor
+from parser_valori import estrai_valori, prepara_input_compatto
+from prompts import ANALYZE_BLOOD_TEST_DESCRIPTION, ANALYZE_BLOOD_TEST_EXPECTED_OUTPUT
 
 # Define tasks
 analyze_blood_test_task = Task(
-    description='''
-    You will be analyzing the following blood test report:
-    "{text}"
-
-    Instructions:
-    1. Review each test result in the report.
-    2. Identify the test name, the value, and the normal range.
-    3. Compare the test value to the normal range:
-        - If the value is within the normal range, note that it is normal.
-        - If the value is outside the normal range, highlight it and explain the potential implications.
-    4. Provide a comprehensive summary including:
-        - An overview of all test results.
-        - A detailed analysis of any abnormal values.
-        - Potential implications of the abnormal results.
-        - Suggestions for further investigation if needed.
-    ''',
-    expected_output='A comprehensive summary of the blood test results, highlighting abnormal values with explanations and potential implications.',
+    description=ANALYZE_BLOOD_TEST_DESCRIPTION,
+    expected_output=ANALYZE_BLOOD_TEST_EXPECTED_OUTPUT,
     agent=blood_test_analyst,
 )
 
@@ -51,3 +38,12 @@ provide_recommendations_task = Task(
     agent=health_advisor,
     context=[analyze_blood_test_task, find_articles_task]
 )
+
+
+def blood_test_inputs(report_text):
+    # Kickoff inputs for analyze_blood_test_task: analyte names are normalized
+    # locally (Hb/HGB/Emoglobina -> HGB), so the agent doesn't reconcile them
+    values = estrai_valori(report_text)
+    if not values:
+        return {"text": report_text}
+    return {"text": prepara_input_compatto(report_text, values)}
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from compattazione import compatta_pagine
+
+INTESTAZIONE = [
+    "Laboratorio Analisi Esempio S.r.l.",
+    "Via Roma 10, 20100 Milano",
+    "Paziente: Rossi Mario",
+]
+
+
+def _pagina(numero, righe):
+    return "\n".join(INTESTAZIONE + righe + [f"Pagina {numero} di 2"])
+
+
+def test_celle_numeriche_ripetute_non_vengono_scartate():
+    # PyPDF2 mette spesso ogni cella della tabella su una riga propria
+    pagine = [
+        _pagina(1, ["Emoglobina", "13,5", "g/dL", "12,0 - 16,0",
+                    "Globuli rossi", "4,1", "10^6/uL", "4,5 - 5,9"]),
+        _pagina(2, ["Creatinina", "1,4", "mg/dL", "0,7 - 1,2",
+                    "Potassio", "4,1", "mmol/L", "3,5 - 5,1"]),
+    ]
+    righe = compatta_pagine(pagine).testo.splitlines()
+    for valore in ("13,5", "12,0 - 16,0", "4,1", "4,5 - 5,9", "1,4", "0,7 - 1,2", "3,5 - 5,1"):
+        assert valore in righe
+    assert righe.count("4,1") == 2
+    # Le intestazioni ripetute restano una volta sola, il boilerplate sparisce
+    assert righe.count("Paziente: Rossi Mario") == 1
+    assert not any(r.startswith("Pagina") for r in righe)
+
+
+def test_righe_senza_riferimento_ripetute_restano():
+    pagine = [_pagina(1, ["Glucosio 95 mg/dL"]), _pagina(2, ["Sodio 140 mmol/L", "Glucosio 95 mg/dL"])]
+    righe = compatta_pagine(pagine).testo.splitlines()
+    assert righe.count("Glucosio 95 mg/dL") == 2
+
+
+def test_note_del_laboratorio_non_sono_boilerplate():
+    nota = "Nota: valori confermati su secondo campione, laboratorio accreditato"
+    risultato = compatta_pagine([_pagina(1, ["Glucosio 95 mg/dL 70 - 100", nota])])
+    assert nota in risultato.testo.splitlines()
+    assert nota in compatta_pagine([nota], solo_analiti=True).testo
@@ -1,23 +1,13 @@
-from crewai_tools import SerperDevTool, WebsiteSearchTool
+from crewai_tools import SerperDevTool
+from retrieval_cache import CachedWebsiteSearchTool, RetrievalCache
+from search_cache import CachedSearchTool, SearchCache
 
 # Define tools
-search_tool = SerperDevTool()
+# Serper searches are cached on disk by normalized query (TTL: SEARCH_CACHE_TTL)
+# and identical concurrent queries share a single request.
+search_tool = CachedSearchTool(backend=SerperDevTool(), cache=SearchCache())
 
-web_search_tool = WebsiteSearchTool(
-    config=dict(
-        llm=dict(
-            provider="google",
-            config=dict(
-                model="gemini-pro",
-                temperature=0.7,
-            ),
-        ),
-        embedder=dict(
-            provider="google",
-            config=dict(
-                model="models/embedding-001",
-                task_type="retrieval_document",
-            ),
-        ),
-    )
-)
+# Website search backed by the persistent Chroma store in db/: pages are
+# fetched and embedded (models/embedding-001) once, then reused across runs.
+# Set RETRIEVAL_EMBEDDER=local to use the offline embedder.
+web_search_tool = CachedWebsiteSearchTool(cache=RetrievalCache())
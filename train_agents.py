@@ -1,66 +1,300 @@
-from medical_crew import MedicalCrew
+import argparse
+import hashlib
 import json
+import os
+import re
+import sys
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from parser_valori import estrai_valori
+from prompts import (
+    ANALYZE_BLOOD_TEST_DESCRIPTION, BLOOD_TEST_ANALYST_BACKSTORY, BLOOD_TEST_ANALYST_GOAL,
+    BLOOD_TEST_ANALYST_ROLE,
+)
+
+# Evaluation harness for the Blood Test Analyst: runs a labelled dataset of
+# reports through a prompt/agent variant with a mock or local LLM and scores
+# the out-of-range analytes it flags.
+#
+# Usage:
+#   python train_agents.py                                  # default variant (prompts.py), mock LLM
+#   python train_agents.py --variant a.json --variant b.json
+#   python train_agents.py --backend local --model llama3.1 # OpenAI-compatible server (LOCAL_LLM_URL)
+#   python train_agents.py --full                           # ignore the checkpoint, re-evaluate everything
+
+DATASET_PATH = "eval_cases.jsonl"
+CHECKPOINT_PATH = os.path.join(".cache", "eval_checkpoint.jsonl")
+RESULTS_PATH = "eval_results.json"
+LOCAL_LLM_URL = os.getenv("LOCAL_LLM_URL", "http://localhost:11434/v1/chat/completions")
+LOCAL_LLM_TIMEOUT = 120
+CHUNK_SIZE = 4
+
+HIGH = re.compile(
+    r"\b(high|elevated|increased|above|raised|alt[oai]|elevat\w*|aumentat\w*|sopra)\b"
+)
+LOW = re.compile(
+    r"\b(low|decreased|reduced|below|deficien\w*|bass[oai]|ridott\w*|diminuit\w*|carenz\w*|sotto)\b"
+)
+
+
+def load_dataset(path=DATASET_PATH):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def default_variant():
+    # The prompt and agent used by the crew, without building the crew itself
+    # (LLM clients, search tools, Chroma store)
+    return {
+        "name": "default",
+        "prompt": ANALYZE_BLOOD_TEST_DESCRIPTION,
+        "agent": {
+            "role": BLOOD_TEST_ANALYST_ROLE,
+            "goal": BLOOD_TEST_ANALYST_GOAL,
+            "backstory": BLOOD_TEST_ANALYST_BACKSTORY,
+        },
+    }
+
+
+def load_variant(path):
+    with open(path, encoding="utf-8") as f:
+        variant = json.load(f)
+    variant.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    return variant
+
+
+def variant_fingerprint(variant):
+    # Everything that can change the output of a case, except the case itself
+    config = {k: v for k, v in variant.items() if k != "name"}
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def case_key(case, fingerprint):
+    payload = fingerprint + json.dumps(case, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MockLLM:
+    # Deterministic stand-in: reports what the local parser finds out of range.
+    # miss_rate drops a stable subset of findings to mimic a weaker model.
+    # The scorer uses the same parser and the mock ignores the instructions, so
+    # every prompt scores the same: it tests the harness, not the prompt.
+    def __init__(self, latency=0.0, miss_rate=0.0, seed=0):
+        self.latency = latency
+        self.miss_rate = miss_rate
+        self.seed = seed
+
+    def _missed(self, name):
+        digest = hashlib.sha256(f"{self.seed}:{name}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:4], "big") / 2**32 < self.miss_rate
+
+    def complete(self, system, prompt):
+        time.sleep(self.latency)
+        lines = ["Summary of the blood test results:"]
+        # The task prompt wraps the report in quotes, which would hide the first/last row
+        for value in estrai_valori(prompt.replace('"', "\n")):
+            if value.fuori_range and not self._missed(value.nome):
+                word = "HIGH" if value.direzione == "alto" else "LOW"
+                lines.append(f"- {value.nome}: {value.riga.strip()} -> {word}")
+            else:
+                lines.append(f"- {value.nome}: within the normal range")
+        return "\n".join(lines)
+
+
+class LocalLLM:
+    # Any OpenAI-compatible chat endpoint (Ollama, llama.cpp server, vLLM)
+    def __init__(self, model, url=LOCAL_LLM_URL, timeout=LOCAL_LLM_TIMEOUT):
+        self.model = model
+        self.url = url
+        self.timeout = timeout
+
+    def complete(self, system, prompt):
+        body = json.dumps({
+            "model": self.model,
+            "temperature": 0,
+            "messages": [{"role": "system", "content": system}, {"role": "user", "content": prompt}],
+        }).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.load(response)["choices"][0]["message"]["content"]
+
+
+def make_llm(config):
+    if config.get("backend", "mock") == "mock":
+        return MockLLM(config.get("latency", 0.0), config.get("miss_rate", 0.0), config.get("seed", 0))
+    return LocalLLM(config["model"], config.get("url", LOCAL_LLM_URL))
+
+
+def system_message(agent):
+    return f"You are {agent['role']}. {agent['goal']}\n\n{agent['backstory']}"
+
+
+def render_prompt(variant, report):
+    # str.format would choke on other braces in the prompt
+    return variant["prompt"].replace("{text}", report)
+
+
+def flagged_analytes(output, candidates):
+    # Longest names first so "Emoglobina glicata" is not also read as "Emoglobina"
+    names = sorted({c.lower() for c in candidates}, key=len, reverse=True)
+    flagged = {}
+    for line in output.lower().splitlines():
+        for name in names:
+            pattern = rf"(?<!\w){re.escape(name)}(?!\w)"
+            if not re.search(pattern, line):
+                continue
+            line = re.sub(pattern, " ", line)
+            high, low = HIGH.search(line), LOW.search(line)
+            if high and (not low or high.start() < low.start()):
+                flagged.setdefault(name, "high")
+            elif low:
+                flagged.setdefault(name, "low")
+    return flagged
+
+
+def score_case(case, output):
+    expected = {e["analyte"].lower(): e["direction"] for e in case["expected_out_of_range"]}
+    candidates = [v.nome for v in estrai_valori(case["report"])] + list(expected)
+    predicted = flagged_analytes(output, candidates)
+    tp = sum(1 for name, direction in predicted.items() if expected.get(name) == direction)
+    return tp, len(predicted) - tp, len(expected) - tp
+
+
+def evaluate_chunk(cases, variant):
+    # Runs in a worker process: no I/O besides the LLM call, results go back in one batch
+    llm = make_llm(variant["llm"])
+    system = system_message(variant["agent"])
+    results = []
+    for case in cases:
+        start = time.perf_counter()
+        try:
+            output, error = llm.complete(system, render_prompt(variant, case["report"])), None
+        except Exception as e:
+            output, error = "", f"{type(e).__name__}: {e}"
+        latency = time.perf_counter() - start
+        tp, fp, fn = score_case(case, output)
+        results.append({"key": case["key"], "id": case["id"], "tp": tp, "fp": fp, "fn": fn,
+                        "latency_s": latency, "error": error})
+    return results
+
+
+def read_checkpoint(path):
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # Truncated by an interruption: the case is simply re-evaluated
+                continue
+            if result.get("error") is None:
+                done[result["key"]] = result
+    return done
+
+
+def aggregate(results):
+    tp = np.array([r["tp"] for r in results])
+    fp = np.array([r["fp"] for r in results])
+    fn = np.array([r["fn"] for r in results])
+    ok = np.array([r["error"] is None for r in results])
+    latency = np.array([r["latency_s"] for r in results]) * 1000
+    precision = tp.sum() / max(tp.sum() + fp.sum(), 1)
+    recall = tp.sum() / max(tp.sum() + fn.sum(), 1)
+    return {
+        "cases": len(results),
+        "errors": int((~ok).sum()),
+        "precision": round(float(precision), 4),
+        "recall": round(float(recall), 4),
+        "f1": round(float(2 * precision * recall / max(precision + recall, 1e-12)), 4),
+        "exact_match": round(float(np.mean(ok & (fp == 0) & (fn == 0))), 4) if results else 0.0,
+        "latency_p50_ms": round(float(np.percentile(latency, 50)), 2) if results else 0.0,
+        "latency_p90_ms": round(float(np.percentile(latency, 90)), 2) if results else 0.0,
+        "latency_p99_ms": round(float(np.percentile(latency, 99)), 2) if results else 0.0,
+        "failed_cases": sorted(r["id"] for r in results if r["fp"] or r["fn"] or r["error"]),
+    }
+
+
+def evaluate(variant, dataset, checkpoint=CHECKPOINT_PATH, incremental=True, workers=None,
+             chunk_size=CHUNK_SIZE):
+    start = time.perf_counter()
+    fingerprint = variant_fingerprint(variant)
+    cases = [dict(case, key=case_key(case, fingerprint)) for case in dataset]
+    done = read_checkpoint(checkpoint) if incremental else {}
+    pending = [case for case in cases if case["key"] not in done]
+
+    if pending:
+        folder = os.path.dirname(checkpoint)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool, open(checkpoint, "a", encoding="utf-8") as f:
+            futures = [pool.submit(evaluate_chunk, chunk, variant) for chunk in chunks]
+            for future in as_completed(futures):
+                batch = future.result()
+                # One write per chunk, so an interrupted run resumes from here
+                f.write("".join(json.dumps(r) + "\n" for r in batch))
+                f.flush()
+                done.update((r["key"], r) for r in batch)
+
+    summary = aggregate([done[case["key"]] for case in cases])
+    summary.update({
+        "variant": variant["name"],
+        "fingerprint": fingerprint[:12],
+        "evaluated": len(pending),
+        "reused": len(cases) - len(pending),
+        "wall_s": round(time.perf_counter() - start, 3),
+    })
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate prompt/agent variants of the Blood Test Analyst.")
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--variant", action="append", default=[],
+                        help="JSON file with name, prompt, agent and optionally llm (repeatable)")
+    parser.add_argument("--backend", choices=["mock", "local"], default="mock")
+    parser.add_argument("--model", help="model name for the local backend")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated mock latency (s)")
+    parser.add_argument("--miss-rate", type=float, default=0.0, help="share of findings the mock drops")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--full", action="store_true", help="re-evaluate every case")
+    parser.add_argument("--output", default=RESULTS_PATH)
+    args = parser.parse_args(argv)
+
+    if args.backend == "local" and not args.model:
+        parser.error("--model is required with --backend local")
+    llm = {"backend": args.backend}
+    if args.backend == "mock":
+        llm.update(latency=args.latency, miss_rate=args.miss_rate)
+    else:
+        llm.update(model=args.model, url=LOCAL_LLM_URL)
+
+    variants = [load_variant(path) for path in args.variant] or [default_variant()]
+    dataset = load_dataset(args.dataset)
+    summaries = []
+    for variant in variants:
+        variant["llm"] = {**llm, **variant.get("llm", {})}
+        summaries.append(evaluate(variant, dataset, args.checkpoint, not args.full, args.workers))
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(summaries, f, indent=2)
+    for s in summaries:
+        print(f"{s['variant']:<20} f1={s['f1']:.3f} precision={s['precision']:.3f} "
+              f"recall={s['recall']:.3f} exact={s['exact_match']:.3f} "
+              f"p50={s['latency_p50_ms']}ms errors={s['errors']} "
+              f"evaluated={s['evaluated']} reused={s['reused']}")
+    if args.backend == "mock":
+        print("Note: the mock LLM ignores the prompt; compare variants with --backend local.")
+    print(f"Results saved to {args.output}.")
+    return 0
 
-def simulate_interaction(agent, input_data, expected_output):
-    try:
-        # Call the appropriate method based on the agent's role
-        if agent.role == 'Blood Test Analyst':
-            agent_output = agent.analyze_report(input_data)
-        elif agent.role == 'Medical Research Specialist':
-            agent_output = agent.conduct_research(input_data)
-        elif agent.role == 'Holistic Health Advisor':
-            agent_output = agent.provide_recommendations(input_data)
-        else:
-            raise Exception(f"Unknown role: {agent.role}")
-        
-        # Compare agent output with expected output
-        if agent_output != expected_output:
-            print(f"Agent '{agent.role}' output did not match expected output.")
-        else:
-            print(f"Agent '{agent.role}' produced the expected output.")
-    
-    except AttributeError:
-        raise Exception(f"Agent '{agent.role}' does not have the required method to process the input.")
-
-def save_agent_config(agents, filename):
-    agent_configs = []
-    for agent in agents:
-        agent_configs.append({
-            'role': agent.role,
-            'goal': agent.goal,
-            'backstory': agent.backstory,
-            # Removed 'expected_output' since it's not an attribute of the agents
-        })
-    
-    with open(filename, 'w') as f:
-        json.dump(agent_configs, f)
-    
-    print(f"Agent configurations saved to {filename}.")
-
-def train_agents(n_iterations, filename):
-    crew = MedicalCrew().crew()
-    
-    try:
-        # Simulate training interactions
-        for _ in range(n_iterations):
-            for agent in crew:
-                # Define input data and expected output for training
-                input_data = {"dummy_data": "example"}  # Replace with actual input data
-                expected_output = "expected_output_example"  # Replace with actual expected output
-                
-                simulate_interaction(agent, input_data, expected_output)
-        
-        # Save the agent configurations
-        save_agent_config(crew, filename)
-        
-        print(f"Training completed successfully. Agent configurations saved to {filename}.")
-    except Exception as e:
-        raise Exception(f"An error occurred while training the crew: {e}")
 
 if __name__ == "__main__":
-    # Specify the number of iterations and output filename
-    n_iterations = 5000000  # Adjust as necessary
-    filename = "trained_agents_config.json"  # Output file for trained agents configuration
-    
-    # Start training
-    train_agents(n_iterations=n_iterations, filename=filename)
+    sys.exit(main())